@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+
+    Query plans and latencies of the hot listing queries, without and with
+    the composite indexes, on a forged SQLite database:
+
+        $ python benchmarks/query_indexes.py --comments 1000000
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bluelog import create_app  # noqa: E402
+from bluelog.extensions import db  # noqa: E402
+from bluelog.models import Post, Category, Comment  # noqa: E402
+
+COMPOSITE_INDEXES = {
+    'ix_post_category_id_timestamp', 'ix_comment_post_id_reviewed_timestamp',
+    'ix_comment_reviewed_timestamp', 'ix_comment_from_admin_timestamp'
+}
+
+
+def forge(categories, posts, comments, batch=10000):
+    start = datetime(2018, 1, 1)
+    db.session.execute(Category.__table__.insert(), [
+        dict(id=i, name='Category %d' % i, post_count=0) for i in range(1, categories + 1)])
+    db.session.execute(Post.__table__.insert(), [
+        dict(id=i, title='Post %d' % i, body='Blah...', category_id=random.randint(1, categories),
+             timestamp=start + timedelta(minutes=i), can_comment=True, comment_count=0)
+        for i in range(1, posts + 1)])
+    for first in range(1, comments + 1, batch):
+        db.session.execute(Comment.__table__.insert(), [
+            dict(id=i, author='Guest', body='A comment', post_id=random.randint(1, posts),
+                 reviewed=random.random() < 0.8, from_admin=random.random() < 0.05,
+                 timestamp=start + timedelta(seconds=i * 30))
+            for i in range(first, min(first + batch, comments + 1))])
+    db.session.commit()
+
+
+def hot_queries(category_id, post_id):
+    return [
+        ('post comments', Comment.query.filter_by(post_id=post_id, reviewed=True)
+            .order_by(Comment.timestamp.asc(), Comment.id.asc()).limit(15)),
+        ('post comments count', Comment.query.filter_by(post_id=post_id, reviewed=True).order_by(None)
+            .with_entities(db.func.count(Comment.id))),
+        ('category posts', Post.query.filter_by(category_id=category_id)
+            .order_by(Post.timestamp.desc(), Post.id.desc()).limit(10)),
+        ('unread comments count', Comment.query.filter_by(reviewed=False).with_entities(db.func.count(Comment.id))),
+        ('admin comments', Comment.query.filter_by(from_admin=True)
+            .order_by(Comment.timestamp.desc(), Comment.id.desc()).limit(15)),
+    ]
+
+
+def literal_sql(query):
+    return str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def measure(query, repeat):
+    timings = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        query.all()
+        timings.append(time.perf_counter() - begin)
+    return statistics.median(timings) * 1000
+
+
+def report(title, queries, repeat):
+    click.echo('\n== %s ==' % title)
+    for name, query in queries:
+        plan = db.session.execute('EXPLAIN QUERY PLAN ' + literal_sql(query)).fetchall()
+        click.echo('%-24s %9.3f ms' % (name, measure(query, repeat)))
+        for row in plan:
+            click.echo('    %s' % row[-1])
+
+
+@click.command()
+@click.option('--categories', default=20, help='Quantity of categories, default is 20.')
+@click.option('--posts', default=10000, help='Quantity of posts, default is 10000.')
+@click.option('--comments', default=1000000, help='Quantity of comments, default is 1000000.')
+@click.option('--repeat', default=20, help='Runs of each query, the median is shown.')
+def main(categories, posts, comments, repeat):
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    app = create_app('production')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.create_all()
+        click.echo('Forging %d categories, %d posts and %d comments...' % (categories, posts, comments))
+        forge(categories, posts, comments)
+
+        indexes = [index for table in (Post.__table__, Comment.__table__)
+                   for index in table.indexes if index.name in COMPOSITE_INDEXES]
+        queries = hot_queries(category_id=1, post_id=posts // 2)
+        for index in indexes:
+            index.drop(bind=db.engine)
+        db.session.execute('ANALYZE')
+        report('single-column indexes', queries, repeat)
+
+        for index in indexes:
+            index.create(bind=db.engine)
+        db.session.execute('ANALYZE')
+        report('composite indexes', queries, repeat)
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
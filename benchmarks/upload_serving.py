@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+
+    Latency and bytes sent by Flask for each view of an uploaded image: the
+    file sent by Flask, a revalidation, and the header left to the web server:
+
+        $ python benchmarks/upload_serving.py --size 500
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bluelog import create_app  # noqa: E402
+from bluelog.uploads import shard_path  # noqa: E402
+
+
+def measure(client, url, headers, requests):
+    timings, sent = [], 0
+    for _ in range(requests):
+        begin = time.perf_counter()
+        response = client.get(url, headers=headers)
+        sent += len(response.data)
+        timings.append(time.perf_counter() - begin)
+    return statistics.median(timings) * 1000, sent // requests, response
+
+
+@click.command()
+@click.option('--size', default=500, help='Size of the image in KiB, default is 500.')
+@click.option('--requests', default=2000, help='Requests of each kind, the median latency is shown.')
+def main(size, requests):
+    upload_path = tempfile.mkdtemp()
+    app = create_app('production')
+    app.config['BLUELOG_UPLOAD_PATH'] = upload_path
+    content = os.urandom(size * 1024)
+    stored = shard_path('ab' * 32, 'png')
+    for filename in ('flat.png', stored):
+        os.makedirs(os.path.join(upload_path, os.path.dirname(filename)), exist_ok=True)
+        with open(os.path.join(upload_path, filename), 'wb') as f:
+            f.write(content)
+    # processed, so it is served as immutable
+    os.makedirs(os.path.join(upload_path, 'variants', stored))
+
+    client = app.test_client()
+    etag = client.get('/admin/uploads/flat.png').headers['ETag']
+    cases = [
+        ('sent by Flask', None, '/admin/uploads/flat.png', {}),
+        ('revalidated (304)', None, '/admin/uploads/flat.png', {'If-None-Match': etag}),
+        ('range of 64 KiB', None, '/admin/uploads/flat.png', {'Range': 'bytes=0-65535'}),
+        ('X-Accel-Redirect', 'x-accel-redirect', '/admin/uploads/flat.png', {}),
+        ('content-addressed', None, '/admin/uploads/' + stored, {}),
+    ]
+    click.echo('%-20s %10s %12s  %s' % ('', 'latency', 'body bytes', 'Cache-Control'))
+    for name, sendfile, url, headers in cases:
+        app.config['BLUELOG_UPLOAD_SENDFILE'] = sendfile
+        latency, sent, response = measure(client, url, headers, requests)
+        click.echo('%-20s %7.3f ms %12d  %s' % (name, latency, sent, response.headers.get('Cache-Control')))
+    click.echo('\nThe content-addressed images are not requested again until they expire from the browser cache.')
+    shutil.rmtree(upload_path)
+
+
+if __name__ == '__main__':
+    main()
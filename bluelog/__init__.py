@@ -19,9 +19,12 @@ from bluelog.blueprints.admin import admin_bp
 from bluelog.blueprints.auth import auth_bp
 from bluelog.blueprints.blog import blog_bp
 from bluelog.blueprints.ai import ai_bp, AIClient
-from bluelog.extensions import bootstrap, db, login_manager, csrf, ckeditor, mail, moment, toolbar, migrate
-from bluelog.models import Admin, Post, Category, Comment, Link
+from bluelog.categories import category_registry
+from bluelog.extensions import bootstrap, db, login_manager, csrf, ckeditor, mail, moment, toolbar, migrate, \
+    page_cache, context_cache, category_cache, search_index, view_counter, image_pipeline
+from bluelog.models import Admin, Post, Category, Comment, Link, PostView, ArchiveMonth, CommentDay, render_post_body
 from bluelog.settings import config
+from bluelog.uploads import init_uploads
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
@@ -96,6 +99,13 @@ def register_extensions(app):
     moment.init_app(app)
     toolbar.init_app(app)
     migrate.init_app(app, db)
+    page_cache.init_app(app)
+    context_cache.init_app(app)
+    category_cache.init_app(app)
+    search_index.init_app(app)
+    view_counter.init_app(app)
+    image_pipeline.init_app(app)
+    init_uploads(app)
 
 
 def register_blueprints(app):
@@ -113,18 +123,32 @@ def register_shell_context(app):
 
 
 def register_template_context(app):
+    def load_template_context():
+        # plain data, so that it can outlive the session it was loaded with
+        admin = Admin.query.first()
+        if admin is not None:
+            admin = dict(name=admin.name, blog_title=admin.blog_title,
+                         blog_sub_title=admin.blog_sub_title, about=admin.about)
+        links = [dict(id=link.id, name=link.name, url=link.url) for link in Link.query.order_by(Link.name)]
+        archives = [dict(year=archive.year, month=archive.month, post_count=archive.post_count)
+                    for archive in ArchiveMonth.query.filter(ArchiveMonth.post_count > 0)
+                    .order_by(ArchiveMonth.year.desc(), ArchiveMonth.month.desc())]
+        popular_posts = [dict(id=post_id, title=title, views=views) for post_id, title, views
+                         in PostView.popular_posts(app.config['BLUELOG_POPULAR_POSTS'])]
+        return dict(admin=admin, links=links, archives=archives, popular_posts=popular_posts)
+
+    def count_unread_comments():
+        return Comment.query.filter_by(reviewed=False).count()
+
     @app.context_processor
     def make_template_context():
-        admin = Admin.query.first()
-        categories = Category.query.order_by(Category.name).all()
-        links = Link.query.order_by(Link.name).all()
+        context = dict(context_cache.get_or_set('template_context', load_template_context))
+        context['categories'] = category_registry().categories
         if current_user.is_authenticated:
-            unread_comments = Comment.query.filter_by(reviewed=False).count()
+            context['unread_comments'] = context_cache.get_or_set('unread_comments', count_unread_comments)
         else:
-            unread_comments = None
-        return dict(
-            admin=admin, categories=categories,
-            links=links, unread_comments=unread_comments)
+            context['unread_comments'] = None
+        return context
 
 
 def register_request_handlers(app):
@@ -139,7 +163,7 @@ def register_request_handlers(app):
         return response
 
 
-def register_commands(app):
+def register_commands(app):  # noqa: C901
     @app.cli.command()
     @click.option('--drop', is_flag=True, help='Create after drop.')
     def initdb(drop):
@@ -185,6 +209,9 @@ def register_commands(app):
             db.session.add(category)
 
         db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
         click.echo('Done.')
 
     @app.cli.command()
@@ -194,6 +221,7 @@ def register_commands(app):
     def forge(category, post, comment):
         """Generate fake data."""
         from bluelog.fakes import fake_admin, fake_categories, fake_posts, fake_comments, fake_links
+        from bluelog.related import update_related_posts
 
         db.drop_all()
         db.create_all()
@@ -213,8 +241,180 @@ def register_commands(app):
         click.echo('Generating links...')
         fake_links()
 
+        Category.update_post_counts()
+        Post.update_comment_counts()
+        ArchiveMonth.update_post_counts()
+        CommentDay.update_comment_counts()
+        db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
+
+        click.echo('Indexing posts...')
+        search_index.rebuild(Post.query.order_by(Post.id).yield_per(500))
+
+        click.echo('Finding related posts...')
+        update_related_posts(app.config['BLUELOG_RELATED_POSTS'], full=True)
+
         click.echo('Done.')
 
+    @app.cli.command()
+    def recount():
+        """Recalculate the post and comment counters, run it periodically to refresh the dashboard."""
+        from bluelog.stats import refresh_post_stats, refresh_comment_stats
+
+        click.echo('Counting posts of categories and months...')
+        refresh_post_stats()
+        click.echo('Counting comments of posts and days...')
+        refresh_comment_stats()
+        db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
+        click.echo('Done.')
+
+    @app.cli.command()
+    @click.option('--all', 'all_posts', is_flag=True, help='Render all the posts, not only the missing ones.')
+    def backfill(all_posts):
+        """Render the excerpts and the HTML bodies of posts."""
+        posts_query = Post.query.order_by(Post.id)
+        if not all_posts:
+            posts_query = posts_query.filter(db.or_(Post.excerpt.is_(None), Post.body_html.is_(None)))
+        count = last_id = 0
+        while True:
+            posts = posts_query.filter(Post.id > last_id).limit(500).all()
+            if not posts:
+                break
+            for post in posts:
+                render_post_body(target=post, value=post.body)
+            db.session.commit()
+            count += len(posts)
+            last_id = posts[-1].id
+        page_cache.invalidate()
+        click.echo('Rendered %d posts.' % count)
+
+    @app.cli.command()
+    @click.option('--full', is_flag=True, help='Compute all the posts, not only the ones touched by changes.')
+    def related(full):
+        """Find the related posts of posts."""
+        from bluelog.related import update_related_posts
+
+        count = update_related_posts(app.config['BLUELOG_RELATED_POSTS'], full=full)
+        page_cache.invalidate()
+        click.echo('Updated the related posts of %d posts.' % count)
+
+    @app.cli.command()
+    def reindex():
+        """Rebuild the full-text search index of posts."""
+        count = search_index.rebuild(Post.query.order_by(Post.id).yield_per(500))
+        click.echo('Indexed %d posts.' % count)
+
+    @app.cli.command()
+    @click.option('--all', 'all_images', is_flag=True, help='Process all the images, not only the missing ones.')
+    def images(all_images):
+        """Strip the metadata of the uploaded images and resize them."""
+        from bluelog.images import process_image, uploaded_files, variant_directory
+        from bluelog.utils import allowed_file
+
+        upload_path = app.config['BLUELOG_UPLOAD_PATH']
+        count = 0
+        for filename in uploaded_files(upload_path):
+            if allowed_file(filename) and (all_images or not os.path.isdir(variant_directory(upload_path, filename))):
+                try:
+                    count += bool(process_image(upload_path, filename, app.config['BLUELOG_IMAGE_QUALITY']))
+                except OSError as e:
+                    click.echo('Failed to process %s: %s' % (filename, e))
+        click.echo('Processed %d images.' % count)
+
+    @app.cli.command()
+    @click.argument('path')
+    @click.option('--format', 'file_format', type=click.Choice(['jsonl', 'markdown']), default='jsonl',
+                  help='One JSONL file, or a directory of Markdown posts with front matters. Default is jsonl.')
+    def export(path, file_format):
+        """Export the posts, categories, comments and links, PATH is - for the standard output."""
+        from bluelog.transfer import export_records, write_jsonl, write_markdown
+
+        if file_format == 'markdown':
+            count = write_markdown(export_records(), path)
+        else:
+            with click.open_file(path, 'w', encoding='utf-8') as f:
+                count = write_jsonl(export_records(), f)
+        click.echo('Exported %d records.' % count, err=path == '-')
+
+    @app.cli.command('import')
+    @click.argument('path', type=click.Path(exists=True))
+    @click.option('--batch-size', default=5000, help='Rows inserted at once, default is 5000.')
+    @click.option('--checkpoint', help='The file saving the progress, default is PATH.checkpoint.')
+    def import_(path, batch_size, checkpoint):
+        """Import the records exported to PATH, an interrupted import is resumed."""
+        from bluelog.stats import refresh_stats
+        from bluelog.transfer import read_jsonl, read_markdown, import_records, reset_sequences
+
+        checkpoint = checkpoint or path.rstrip('/\\') + '.checkpoint'
+        if not os.path.exists(checkpoint) and Post.query.first() is not None:
+            raise click.UsageError('The database has posts already, import into an empty one.')
+
+        click.echo('Importing records...')
+        if os.path.isdir(path):
+            count = import_records(read_markdown(path), batch_size, checkpoint)
+        else:
+            with open(path, encoding='utf-8') as f:
+                count = import_records(read_jsonl(f), batch_size, checkpoint)
+        reset_sequences()
+
+        click.echo('Counting posts and comments...')
+        refresh_stats()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
+        click.echo('Indexing posts...')
+        search_index.rebuild(Post.query.order_by(Post.id).yield_per(500))
+        os.remove(checkpoint)
+        click.echo('Done, imported %d records.' % count)
+
+    @app.cli.command()
+    @click.option('--path', help='The directory of the static site, default is BLUELOG_FREEZE_PATH.')
+    @click.option('--base-url', default='http://localhost/', help='The URL the site is served from.')
+    @click.option('--post', 'post_ids', type=int, multiple=True, help='Only re-freeze the pages of this post.')
+    @click.option('--comment', 'comment_ids', type=int, multiple=True,
+                  help='Only re-freeze the pages of the post of this comment.')
+    def freeze(path, base_url, post_ids, comment_ids):
+        """Render the public pages into static files."""
+        from bluelog.freezer import Freezer
+
+        freezer = Freezer(path or app.config['BLUELOG_FREEZE_PATH'], base_url)
+        build = freezer.adapter.build
+        post_ids = set(post_ids)
+        if comment_ids:
+            post_ids.update(post_id for post_id, in
+                            db.session.query(Comment.post_id).filter(Comment.id.in_(comment_ids)))
+
+        if post_ids:
+            urls = [build('blog.index')]
+            for post_id in sorted(post_ids):
+                post = Post.query.get(post_id)
+                if post is None:  # deleted, the category listing is only fixed by a full freeze
+                    freezer.remove(build('blog.show_post', {'post_id': post_id}))
+                    continue
+                urls.append(build('blog.show_post', {'post_id': post_id}))
+                urls.append(build('blog.show_category', {'category_id': post.category_id}))
+                urls.append(build('blog.show_archive', {'year': post.timestamp.year, 'month': post.timestamp.month}))
+        else:
+            urls = [build('blog.index'), build('blog.about'), build('blog.archive')]
+            urls.extend(build('blog.show_category', {'category_id': category_id})
+                        for category_id, in db.session.query(Category.id).order_by(Category.id))
+            urls.extend(build('blog.show_archive', {'year': year, 'month': month})
+                        for year, month in db.session.query(ArchiveMonth.year, ArchiveMonth.month)
+                        .filter(ArchiveMonth.post_count > 0))
+            urls.extend(build('blog.show_post', {'post_id': post_id})
+                        for post_id, in db.session.query(Post.id).order_by(Post.id))
+
+        click.echo('Freezing pages...')
+        count = freezer.freeze(urls)
+        click.echo('Copying static files and uploads...')
+        freezer.copy_files()
+        click.echo('Done, %d pages changed.' % count)
+
 
 def register_errors(app):
     @app.errorhandler(400)
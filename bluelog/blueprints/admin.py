@@ -6,19 +6,30 @@
     :license: MIT, see LICENSE for more details.
 """
 import os
+from datetime import datetime
 
-from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, send_from_directory
+from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint
 from flask_login import login_required, current_user
 from flask_ckeditor import upload_success, upload_fail
 
-from bluelog.extensions import db
+from bluelog.extensions import db, page_cache, context_cache, category_cache, search_index, image_pipeline
 from bluelog.forms import SettingForm, PostForm, CategoryForm, LinkForm
-from bluelog.models import Post, Category, Comment, Link
+from bluelog.models import Post, Category, Comment, Link, PostRelated, PostRevision, PostView, ArchiveMonth, CommentDay
+from bluelog.pagination import paginate
+from bluelog.revisions import diff_lines
+from bluelog.stats import dashboard_stats
+from bluelog.uploads import store_upload, send_upload
 from bluelog.utils import redirect_back, allowed_file
 
 admin_bp = Blueprint('admin', __name__)
 
 
+@admin_bp.route('/')
+@login_required
+def dashboard():
+    return render_template('admin/dashboard.html', **dashboard_stats())
+
+
 @admin_bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
@@ -29,6 +40,8 @@ def settings():
         current_user.blog_sub_title = form.blog_sub_title.data
         current_user.about = form.about.data
         db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
         flash('Setting updated.', 'success')
         return redirect(url_for('blog.index'))
     form.name.data = current_user.name
@@ -41,11 +54,10 @@ def settings():
 @admin_bp.route('/post/manage')
 @login_required
 def manage_post():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['BLUELOG_MANAGE_POST_PER_PAGE'])
+    pagination = paginate(Post.query.options(db.joinedload(Post.category)), Post.timestamp,
+                          current_app.config['BLUELOG_MANAGE_POST_PER_PAGE'])
     posts = pagination.items
-    return render_template('admin/manage_post.html', page=page, pagination=pagination, posts=posts)
+    return render_template('admin/manage_post.html', pagination=pagination, posts=posts)
 
 
 @admin_bp.route('/post/new', methods=['GET', 'POST'])
@@ -60,8 +72,16 @@ def new_post():
         # same with:
         # category_id = form.category.data
         # post = Post(title=title, body=body, category_id=category_id)
+        category.post_count = Category.post_count + 1
         db.session.add(post)
+        db.session.flush()  # the timestamp is set
+        ArchiveMonth.count_post(post.timestamp)
+        PostRevision.record(post, current_app.config['BLUELOG_REVISION_SNAPSHOT_INTERVAL'])
         db.session.commit()
+        search_index.add(post)
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
         flash('Post created.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
     return render_template('admin/new_post.html', form=form)
@@ -73,10 +93,21 @@ def edit_post(post_id):
     form = PostForm()
     post = Post.query.get_or_404(post_id)
     if form.validate_on_submit():
+        snapshot_interval = current_app.config['BLUELOG_REVISION_SNAPSHOT_INTERVAL']
+        PostRevision.record(post, snapshot_interval)  # posts written before the history was kept
         post.title = form.title.data
         post.body = form.body.data
-        post.category = Category.query.get(form.category.data)
+        category = Category.query.get(form.category.data)
+        if category.id != post.category_id:
+            post.category.post_count = Category.post_count - 1
+            category.post_count = Category.post_count + 1
+            post.category = category
+        PostRevision.record(post, snapshot_interval)
         db.session.commit()
+        search_index.add(post)
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
         flash('Post updated.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
     form.title.data = post.title
@@ -89,12 +120,62 @@ def edit_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
+    post.category.post_count = Category.post_count - 1
+    ArchiveMonth.count_post(post.timestamp, -1)
+    for day, count, unread in CommentDay.comment_days(Comment.post_id == post_id):
+        CommentDay.count_comment(day, -count, -unread)
+    PostRelated.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+    # the posts listing it keep an empty place, which the next flask related fills again
+    PostRelated.query.filter_by(related_id=post_id).update({PostRelated.related_id: None}, synchronize_session=False)
+    PostView.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+    PostRevision.query.filter_by(post_id=post_id).delete(synchronize_session=False)
     db.session.delete(post)
     db.session.commit()
+    search_index.remove(post_id)
+    page_cache.invalidate()
+    context_cache.invalidate()
+    category_cache.invalidate()
     flash('Post deleted.', 'success')
     return redirect_back()
 
 
+@admin_bp.route('/post/<int:post_id>/revisions')
+@login_required
+def post_revisions(post_id):
+    post = Post.query.get_or_404(post_id)
+    pagination = paginate(PostRevision.query.filter_by(post_id=post_id), PostRevision.timestamp,
+                          current_app.config['BLUELOG_MANAGE_POST_PER_PAGE'])
+    revisions = pagination.items
+    return render_template('admin/post_revisions.html', post=post, pagination=pagination, revisions=revisions)
+
+
+@admin_bp.route('/post/<int:post_id>/revision/<int:number>')
+@login_required
+def show_revision(post_id, number):
+    post = Post.query.get_or_404(post_id)
+    revision = PostRevision.query.filter_by(post_id=post_id, number=number).first_or_404()
+    against = PostRevision.query.filter_by(post_id=post_id, number=request.args.get('against', number - 1, type=int)) \
+        .first()
+    diff = diff_lines(against.load_body() if against else '', revision.load_body())
+    return render_template('admin/revision.html', post=post, revision=revision, against=against, diff=diff)
+
+
+@admin_bp.route('/post/<int:post_id>/revision/<int:number>/restore', methods=['POST'])
+@login_required
+def restore_revision(post_id, number):
+    post = Post.query.get_or_404(post_id)
+    revision = PostRevision.query.filter_by(post_id=post_id, number=number).first_or_404()
+    post.title = revision.title
+    post.body = revision.load_body()
+    PostRevision.record(post, current_app.config['BLUELOG_REVISION_SNAPSHOT_INTERVAL'])
+    db.session.commit()
+    search_index.add(post)
+    page_cache.invalidate()
+    context_cache.invalidate()
+    flash('Revision %d restored.' % number, 'success')
+    return redirect(url_for('.post_revisions', post_id=post_id))
+
+
 @admin_bp.route('/post/<int:post_id>/set-comment', methods=['POST'])
 @login_required
 def set_comment(post_id):
@@ -106,6 +187,7 @@ def set_comment(post_id):
         post.can_comment = True
         flash('Comment enabled.', 'success')
     db.session.commit()
+    page_cache.invalidate()
     return redirect_back()
 
 
@@ -113,7 +195,6 @@ def set_comment(post_id):
 @login_required
 def manage_comment():
     filter_rule = request.args.get('filter', 'all')  # 'all', 'unreviewed', 'admin'
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_COMMENT_PER_PAGE']
     if filter_rule == 'unread':
         filtered_comments = Comment.query.filter_by(reviewed=False)
@@ -122,7 +203,7 @@ def manage_comment():
     else:
         filtered_comments = Comment.query
 
-    pagination = filtered_comments.order_by(Comment.timestamp.desc()).paginate(page, per_page=per_page)
+    pagination = paginate(filtered_comments, Comment.timestamp, per_page)
     comments = pagination.items
     return render_template('admin/manage_comment.html', comments=comments, pagination=pagination)
 
@@ -131,8 +212,13 @@ def manage_comment():
 @login_required
 def approve_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
-    comment.reviewed = True
+    if not comment.reviewed:
+        comment.reviewed = True
+        comment.post.comment_count = Post.comment_count + 1
+        CommentDay.count_comment(comment.timestamp, 0, -1)
     db.session.commit()
+    page_cache.invalidate()
+    context_cache.invalidate()
     flash('Comment published.', 'success')
     return redirect_back()
 
@@ -141,12 +227,60 @@ def approve_comment(comment_id):
 @login_required
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
-    db.session.delete(comment)
-    db.session.commit()
+    comment.delete()
+    page_cache.invalidate()
+    context_cache.invalidate()
     flash('Comment deleted.', 'success')
     return redirect_back()
 
 
+def comment_criteria():
+    """The comments picked in the bulk forms of the manage page, by ID or by filter."""
+    criteria = []
+    comment_ids = request.form.getlist('comment_id', type=int)
+    if comment_ids:
+        criteria.append(Comment.id.in_(comment_ids))
+    if request.form.get('unread'):
+        criteria.append(Comment.reviewed.is_(False))
+    if request.form.get('email'):
+        criteria.append(Comment.email == request.form['email'].strip())
+    before = request.form.get('before', type=lambda value: datetime.strptime(value, '%Y-%m-%d'))
+    if before is not None:
+        criteria.append(Comment.timestamp < before)
+    elif request.form.get('before'):
+        flash('Invalid date.', 'warning')
+        return None
+    if not criteria:
+        flash('No comments selected.', 'warning')
+    return criteria
+
+
+@admin_bp.route('/comment/approve', methods=['POST'])
+@login_required
+def approve_comments():
+    criteria = comment_criteria()
+    if criteria:
+        count = Comment.approve_all(*criteria)
+        db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        flash('%d comments published.' % count, 'success')
+    return redirect_back()
+
+
+@admin_bp.route('/comment/delete', methods=['POST'])
+@login_required
+def delete_comments():
+    criteria = comment_criteria()
+    if criteria:
+        count = Comment.delete_all(*criteria)
+        db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        flash('%d comments deleted.' % count, 'success')
+    return redirect_back()
+
+
 @admin_bp.route('/category/manage')
 @login_required
 def manage_category():
@@ -162,6 +296,9 @@ def new_category():
         category = Category(name=name)
         db.session.add(category)
         db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
         flash('Category created.', 'success')
         return redirect(url_for('.manage_category'))
     return render_template('admin/new_category.html', form=form)
@@ -178,6 +315,9 @@ def edit_category(category_id):
     if form.validate_on_submit():
         category.name = form.name.data
         db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
+        category_cache.invalidate()
         flash('Category updated.', 'success')
         return redirect(url_for('.manage_category'))
 
@@ -193,6 +333,9 @@ def delete_category(category_id):
         flash('You can not delete the default category.', 'warning')
         return redirect(url_for('blog.index'))
     category.delete()
+    page_cache.invalidate()
+    context_cache.invalidate()
+    category_cache.invalidate()
     flash('Category deleted.', 'success')
     return redirect(url_for('.manage_category'))
 
@@ -213,6 +356,8 @@ def new_link():
         link = Link(name=name, url=url)
         db.session.add(link)
         db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
         flash('Link created.', 'success')
         return redirect(url_for('.manage_link'))
     return render_template('admin/new_link.html', form=form)
@@ -227,6 +372,8 @@ def edit_link(link_id):
         link.name = form.name.data
         link.url = form.url.data
         db.session.commit()
+        page_cache.invalidate()
+        context_cache.invalidate()
         flash('Link updated.', 'success')
         return redirect(url_for('.manage_link'))
     form.name.data = link.name
@@ -240,13 +387,20 @@ def delete_link(link_id):
     link = Link.query.get_or_404(link_id)
     db.session.delete(link)
     db.session.commit()
+    page_cache.invalidate()
+    context_cache.invalidate()
     flash('Link deleted.', 'success')
     return redirect(url_for('.manage_link'))
 
 
 @admin_bp.route('/uploads/<path:filename>')
 def get_image(filename):
-    return send_from_directory(current_app.config['BLUELOG_UPLOAD_PATH'], filename)
+    upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+    if filename.startswith('variants/') and not os.path.isfile(os.path.join(upload_path, filename)):
+        # not processed yet, or not an image that is, the original stands in
+        original = filename[len('variants/'):].rsplit('/', 1)[0]
+        return send_upload(upload_path, original, cache_timeout=0)
+    return send_upload(upload_path, filename)
 
 
 @admin_bp.route('/upload', methods=['POST'])
@@ -254,6 +408,10 @@ def upload_image():
     f = request.files.get('upload')
     if not allowed_file(f.filename):
         return upload_fail('Image only!')
-    f.save(os.path.join(current_app.config['BLUELOG_UPLOAD_PATH'], f.filename))
-    url = url_for('.get_image', filename=f.filename)
+    upload, created = store_upload(f, current_app.config['BLUELOG_UPLOAD_PATH'])
+    if upload is None:
+        return upload_fail('Image only!')
+    if created:
+        image_pipeline.submit(upload.filename)
+    url = url_for('.get_image', filename=upload.filename)
     return upload_success(url, f.filename)
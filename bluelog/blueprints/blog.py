@@ -5,23 +5,49 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, abort, make_response
+from datetime import datetime
+
+from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, abort, make_response, \
+    send_file, Response
 from flask_login import current_user
+from flask_sqlalchemy import Pagination
 
 from bluelog.emails import send_new_comment_email, send_new_reply_email
-from bluelog.extensions import db
+from bluelog.extensions import db, csrf, page_cache, context_cache, search_index, view_counter
 from bluelog.forms import CommentForm, AdminCommentForm
-from bluelog.models import Post, Category, Comment
+from bluelog.models import Post, Category, Comment, CommentDay
+from bluelog.pagination import paginate
+from bluelog.sitemap import urlset, page_urls, post_urls, sitemap_index, cached_sitemap, category_version, \
+    post_shards, shard_range, shard_version
 from bluelog.utils import redirect_back
 
 blog_bp = Blueprint('blog', __name__)
 
 
+def posts_version(category_id=None):
+    last_modified = db.session.query(db.func.max(Post.updated_at))
+    post_count = db.session.query(db.func.sum(Category.post_count))
+    if category_id is not None:
+        last_modified = last_modified.filter(Post.category_id == category_id)
+        post_count = post_count.filter(Category.id == category_id)
+    last_modified = last_modified.scalar()
+    return (category_id, last_modified, post_count.scalar()), last_modified
+
+
+def post_version(post_id):
+    last_modified = db.session.query(Post.updated_at).filter_by(id=post_id).scalar()
+    if last_modified is None:
+        return None
+    return (post_id, last_modified), last_modified
+
+
 @blog_bp.route('/')
+@page_cache.conditional(posts_version)
+@page_cache.cached
 def index():
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_POST_PER_PAGE']
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(page, per_page=per_page)
+    posts_query = Post.query.options(db.joinedload(Post.category), db.defer(Post.body), db.defer(Post.body_html))
+    pagination = paginate(posts_query, Post.timestamp, per_page)
     posts = pagination.items
     return render_template('blog/index.html', pagination=pagination, posts=posts)
 
@@ -32,23 +58,56 @@ def about():
 
 
 @blog_bp.route('/category/<int:category_id>')
+@page_cache.conditional(posts_version)
+@page_cache.cached
 def show_category(category_id):
     category = Category.query.get_or_404(category_id)
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_POST_PER_PAGE']
-    pagination = Post.query.with_parent(category).order_by(Post.timestamp.desc()).paginate(page, per_page)
+    # post.category of these posts is found in the identity map, no need to load it again
+    posts_query = Post.query.with_parent(category).options(db.defer(Post.body), db.defer(Post.body_html))
+    pagination = paginate(posts_query, Post.timestamp, per_page)
     posts = pagination.items
     return render_template('blog/category.html', category=category, pagination=pagination, posts=posts)
 
 
+@blog_bp.route('/archive')
+@page_cache.cached
+def archive():
+    return render_template('blog/archive.html')
+
+
+def archive_version(year, month):
+    return posts_version()
+
+
+@blog_bp.route('/archive/<int:year>/<int:month>')
+@page_cache.conditional(archive_version)
+@page_cache.cached
+def show_archive(year, month):
+    if not (1 <= month <= 12 and 1 <= year < 9999):
+        abort(404)
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    per_page = current_app.config['BLUELOG_POST_PER_PAGE']
+    posts_query = Post.query.filter(Post.timestamp >= start, Post.timestamp < end) \
+        .options(db.joinedload(Post.category), db.defer(Post.body), db.defer(Post.body_html))
+    pagination = paginate(posts_query, Post.timestamp, per_page)
+    posts = pagination.items
+    return render_template('blog/archive_month.html', month=start, pagination=pagination, posts=posts)
+
+
 @blog_bp.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@csrf.exempt
+@view_counter.counted
+@page_cache.conditional(post_version)
+@page_cache.cached
 def show_post(post_id):
-    post = Post.query.get_or_404(post_id)
-    page = request.args.get('page', 1, type=int)
+    post = Post.query.options(db.joinedload(Post.category)).get_or_404(post_id)
     per_page = current_app.config['BLUELOG_COMMENT_PER_PAGE']
-    pagination = Comment.query.with_parent(post).filter_by(reviewed=True).order_by(Comment.timestamp.asc()).paginate(
-        page, per_page)
-    comments = pagination.items
+    # a page of threads, the replies of any depth are loaded with them in one query
+    roots_query = Comment.thread_roots(post).options(db.joinedload(Comment.replied))
+    pagination = paginate(roots_query, Comment.timestamp, per_page, descending=False)
+    comments = Comment.load_tree(post, pagination.items)
 
     if current_user.is_authenticated:
         form = AdminCommentForm()
@@ -58,7 +117,9 @@ def show_post(post_id):
         from_admin = True
         reviewed = True
     else:
-        form = CommentForm()
+        # the guest form carries no CSRF token, so one rendered page can be shared
+        # by all the readers; the admin form above is still protected
+        form = CommentForm(meta={'csrf': False})
         from_admin = False
         reviewed = False
 
@@ -75,15 +136,96 @@ def show_post(post_id):
             replied_comment = Comment.query.get_or_404(replied_id)
             comment.replied = replied_comment
             send_new_reply_email(replied_comment)
+        if reviewed:
+            post.comment_count = Post.comment_count + 1
         db.session.add(comment)
+        db.session.flush()  # the timestamp is set
+        CommentDay.count_comment(comment.timestamp, unread=0 if reviewed else 1)
         db.session.commit()
         if current_user.is_authenticated:  # send message based on authentication status
+            page_cache.invalidate()
             flash('Comment published.', 'success')
         else:
+            context_cache.invalidate()  # the count of unread comments changed
             flash('Thanks, your comment will be published after reviewed.', 'info')
             send_new_comment_email(post)  # send notification email to admin
         return redirect(url_for('.show_post', post_id=post_id))
-    return render_template('blog/post.html', post=post, pagination=pagination, form=form, comments=comments)
+    return render_template('blog/post.html', post=post, pagination=pagination, form=form, comments=comments,
+                           related_posts=post.related_posts())
+
+
+def feed_version(feed_type, category_id=None):
+    return posts_version(category_id)
+
+
+@blog_bp.route('/feed/<any(atom, rss):feed_type>')
+@blog_bp.route('/category/<int:category_id>/feed/<any(atom, rss):feed_type>')
+@page_cache.conditional(feed_version)
+@page_cache.cached
+def feed(feed_type, category_id=None):
+    full_body = current_app.config['BLUELOG_FEED_FULL_BODY']
+    posts_query = Post.query.options(db.joinedload(Post.category), db.defer(Post.body))
+    if not full_body:
+        posts_query = posts_query.options(db.defer(Post.body_html))
+    category = None
+    if category_id is not None:
+        category = Category.query.get_or_404(category_id)
+        posts_query = posts_query.filter(Post.category_id == category_id)
+    posts = posts_query.order_by(Post.timestamp.desc(), Post.id.desc()) \
+        .limit(current_app.config['BLUELOG_FEED_ITEMS']).all()
+    updated = max([post.updated_at or post.timestamp for post in posts] or [datetime.utcnow()])
+    response = make_response(render_template('feeds/%s.xml' % feed_type, posts=posts, category=category,
+                                             updated=updated, full_body=full_body))
+    response.mimetype = 'application/atom+xml' if feed_type == 'atom' else 'application/rss+xml'
+    return response
+
+
+def send_sitemap(path):
+    return send_file(path, mimetype='application/xml', conditional=True, cache_timeout=0)
+
+
+@blog_bp.route('/sitemap.xml')
+def sitemap():
+    size = current_app.config['BLUELOG_SITEMAP_SHARD_SIZE']
+    categories = category_version()
+    shards = post_shards(size)
+    if 2 + categories[0] + sum(count for _, count, _ in shards) <= size:
+        return send_sitemap(cached_sitemap('all', (categories, shards), lambda: urlset(page_urls(), post_urls())))
+
+    sitemaps = [(url_for('.sitemap_pages', _external=True), None)]
+    sitemaps.extend((url_for('.sitemap_posts', shard=shard, _external=True), lastmod) for shard, _, lastmod in shards)
+    return Response(sitemap_index(sitemaps), mimetype='application/xml')
+
+
+@blog_bp.route('/sitemap-pages.xml')
+def sitemap_pages():
+    return send_sitemap(cached_sitemap('pages', category_version(), lambda: urlset(page_urls())))
+
+
+@blog_bp.route('/sitemap-posts-<int:shard>.xml')
+def sitemap_posts(shard):
+    size = current_app.config['BLUELOG_SITEMAP_SHARD_SIZE']
+    version = shard_version(shard, size)
+    if not version[0]:
+        abort(404)
+    return send_sitemap(cached_sitemap('posts-%d' % shard, version,
+                                       lambda: urlset(post_urls(*shard_range(shard, size)))))
+
+
+@blog_bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['BLUELOG_SEARCH_RESULT_PER_PAGE']
+    total, hits = search_index.search(q, page, per_page)
+    posts = {}
+    if hits:
+        posts_query = Post.query.options(db.joinedload(Post.category), db.defer(Post.body), db.defer(Post.body_html))
+        posts = {post.id: post for post in posts_query.filter(Post.id.in_([hit.post_id for hit in hits]))}
+    # keep the order of the ranking, and skip the posts deleted since they were indexed
+    results = [(posts[hit.post_id], hit) for hit in hits if hit.post_id in posts]
+    pagination = Pagination(None, page, per_page, total, results)
+    return render_template('blog/search.html', q=q, pagination=pagination, results=results)
 
 
 @blog_bp.route('/reply/comment/<int:comment_id>')
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import request, session, current_app
+from flask_login import current_user
+
+
+class VersionStamp(object):
+    """A version token shared by every worker process through a small file.
+
+    Bumping the stamp in one process (a gunicorn worker or a CLI command)
+    is seen by all the others on their next read.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = None
+
+    def init_app(self, app):
+        cache_path = app.config['BLUELOG_CACHE_PATH']
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+        self.path = os.path.join(cache_path, '%s.version' % self.name)
+
+    @property
+    def version(self):
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except (IOError, OSError):  # never bumped
+            return ''
+
+    @property
+    def modified(self):
+        try:
+            return datetime.utcfromtimestamp(os.path.getmtime(self.path))
+        except (IOError, OSError):
+            return None
+
+    def bump(self):
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, self.path)
+
+
+class VersionedCache(object):
+    """In-process cache which is dropped as soon as its version stamp changes."""
+
+    def __init__(self, name, maxsize=None):
+        self.stamp = VersionStamp(name)
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._version = None
+        self._store = OrderedDict()
+
+    def init_app(self, app):
+        self.stamp.init_app(app)
+        with self._lock:
+            self._version = None
+            self._store.clear()
+
+    def get(self, key, version=None):
+        if version is None:
+            version = self.stamp.version
+        with self._lock:
+            if version != self._version:
+                self._store.clear()
+                self._version = version
+                return None
+            value = self._store.get(key)
+            if value is not None:
+                self._store.move_to_end(key)
+            return value
+
+    def set(self, key, value, version):
+        with self._lock:
+            # the data was loaded before a write bumped the stamp, don't keep it
+            if version != self._version:
+                return
+            self._store[key] = value
+            if self.maxsize and len(self._store) > self.maxsize:
+                self._store.popitem(last=False)
+
+    def get_or_set(self, key, loader):
+        version = self.stamp.version
+        value = self.get(key, version)
+        if value is None:
+            value = loader()
+            self.set(key, value, version)
+        return value
+
+    def invalidate(self):
+        self.stamp.bump()
+
+
+class PageCache(VersionedCache):
+    """Full-page cache for the public pages seen by anonymous readers."""
+
+    def init_app(self, app):
+        super(PageCache, self).init_app(app)
+        self.maxsize = app.config['BLUELOG_PAGE_CACHE_SIZE']
+
+    @staticmethod
+    def _anonymous_get():
+        return request.method == 'GET' and not current_user.is_authenticated and '_flashes' not in session
+
+    def _cacheable(self):
+        return current_app.config['BLUELOG_PAGE_CACHE'] and self._anonymous_get()
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._cacheable():
+                return view(*args, **kwargs)
+
+            key = (request.path, request.query_string, request.cookies.get('theme'))
+            version = self.stamp.version
+            page = self.get(key, version)
+            if page is not None:
+                body, mimetype = page
+                return current_app.response_class(body, mimetype=mimetype)
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                self.set(key, (response.get_data(), response.mimetype), version)
+            return response
+        return wrapper
+
+    def _validators(self, version, last_modified):
+        etag = hashlib.sha1(repr((version, self.stamp.version, request.full_path,
+                                  request.cookies.get('theme'))).encode('utf-8')).hexdigest()
+        # the sidebar and the settings change the page too
+        stamp_modified = self.stamp.modified
+        if last_modified is None or (stamp_modified is not None and stamp_modified > last_modified):
+            last_modified = stamp_modified
+        if last_modified is not None:
+            last_modified = last_modified.replace(microsecond=0)
+        return etag, last_modified
+
+    @staticmethod
+    def _not_modified(etag, last_modified):
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        return last_modified is not None and request.if_modified_since is not None and \
+            request.if_modified_since >= last_modified
+
+    def conditional(self, validator):
+        """Answer conditional GETs of anonymous readers before the page is rendered.
+
+        ``validator`` is called with the view arguments and returns the version
+        of the content and the time it was last modified, or None to skip.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                content = validator(**kwargs) if self._anonymous_get() else None
+                if content is None:
+                    return view(*args, **kwargs)
+
+                etag, last_modified = self._validators(*content)
+                if self._not_modified(etag, last_modified):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.cache_control.no_cache = True
+                return response
+            return wrapper
+        return decorator
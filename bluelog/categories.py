@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from bluelog.extensions import category_cache
+from bluelog.models import Category
+
+
+class CategoryRegistry(object):
+    """All the categories loaded at once, with their lookups and the choices of the post form.
+
+    It is shared by the requests of a process until ``category_cache`` is
+    invalidated, so it is never changed after it is built.
+    """
+
+    def __init__(self, rows):
+        self.categories = [dict(id=category_id, name=name, post_count=post_count)
+                           for category_id, name, post_count in rows]
+        self.choices = [(category['id'], category['name']) for category in self.categories]
+        self._ids = {category['id']: category for category in self.categories}
+        self._names = {category['name']: category for category in self.categories}
+
+    def __contains__(self, category_id):
+        return category_id in self._ids
+
+    def __len__(self):
+        return len(self.categories)
+
+    def get(self, category_id):
+        return self._ids.get(category_id)
+
+    def get_by_name(self, name):
+        return self._names.get(name)
+
+
+def load_category_registry():
+    return CategoryRegistry(Category.query.with_entities(Category.id, Category.name, Category.post_count)
+                            .order_by(Category.name))
+
+
+def category_registry():
+    return category_cache.get_or_set('registry', load_category_registry)
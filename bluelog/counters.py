@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import request, current_app
+from sqlalchemy.exc import IntegrityError
+
+
+class ViewCounter(object):
+    """Count post views in memory and write the sums to ``post_views`` in batches.
+
+    Each worker process keeps its own buffer and adds it to the stored counts
+    with relative updates, so the workers never overwrite each other. The
+    buffer is flushed when it holds ``BLUELOG_VIEW_FLUSH_THRESHOLD`` views, on
+    the first view after ``BLUELOG_VIEW_FLUSH_INTERVAL`` seconds and when the
+    process exits.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.threshold = 100
+        self.interval = 10
+        self._lock = threading.Lock()
+        self._views = Counter()
+        self._pending = 0
+        self._flushed_at = time.time()
+        self._pid = os.getpid()
+
+    def init_app(self, app):
+        if self.app is None:
+            atexit.register(self.flush)
+        self.app = app
+        self.threshold = app.config['BLUELOG_VIEW_FLUSH_THRESHOLD']
+        self.interval = app.config['BLUELOG_VIEW_FLUSH_INTERVAL']
+        with self._lock:
+            self._views.clear()
+            self._pending = 0
+            self._flushed_at = time.time()
+
+    def hit(self, post_id):
+        with self._lock:
+            if self._pid != os.getpid():  # a forked worker, the views belong to the parent
+                self._pid = os.getpid()
+                self._views.clear()
+                self._pending = 0
+            self._views[post_id] += 1
+            self._pending += 1
+            due = self._pending >= self.threshold or time.time() - self._flushed_at >= self.interval
+        if due:
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            views, self._views = self._views, Counter()
+            self._pending = 0
+            self._flushed_at = time.time()
+        return views
+
+    def flush(self):
+        """Add the buffered views to the stored counts, returns the count of posts written."""
+        views = self._take()
+        if not views or self.app is None:
+            return 0
+        from bluelog.extensions import db, context_cache
+        from bluelog.models import Post, PostView
+
+        table = PostView.__table__
+        rows = [dict(view_post_id=post_id, delta=delta) for post_id, delta in views.items()]
+        update = table.update().where(table.c.post_id == db.bindparam('view_post_id')) \
+            .values(views=table.c.views + db.bindparam('delta'))
+        # the first views of a post, deleted posts are skipped
+        insert = table.insert().from_select(
+            ['post_id', 'views'],
+            db.select([Post.id, db.bindparam('delta')]).where(db.and_(
+                Post.id == db.bindparam('view_post_id'),
+                ~db.exists().where(table.c.post_id == db.bindparam('view_post_id')))))
+        with self.app.app_context():
+            for attempt in range(2):
+                try:
+                    with db.engine.begin() as connection:
+                        written = connection.execute(update, rows).rowcount + connection.execute(insert, rows).rowcount
+                    break
+                except IntegrityError:  # another worker inserted the same post first, the update now applies
+                    if attempt:
+                        raise
+            if written:  # the popular posts of the sidebar
+                context_cache.invalidate()
+        return len(rows)
+
+    def counted(self, view):
+        """Count a view of the post when the page is shown, from the cache or not, but not by the freezer."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = current_app.make_response(view(*args, **kwargs))
+            if request.method == 'GET' and response.status_code in (200, 304) and \
+                    not request.environ.get('bluelog.freezing'):
+                self.hit(kwargs['post_id'])
+            return response
+        return wrapper
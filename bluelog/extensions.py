@@ -15,6 +15,11 @@ from flask_wtf import CSRFProtect
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_migrate import Migrate
 
+from bluelog.caching import PageCache, VersionedCache
+from bluelog.counters import ViewCounter
+from bluelog.images import ImagePipeline
+from bluelog.search import SearchIndex
+
 bootstrap = Bootstrap()
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -24,6 +29,12 @@ mail = Mail()
 moment = Moment()
 toolbar = DebugToolbarExtension()
 migrate = Migrate()
+page_cache = PageCache('pages')
+context_cache = VersionedCache('context')
+category_cache = VersionedCache('categories')
+search_index = SearchIndex()
+view_counter = ViewCounter()
+image_pipeline = ImagePipeline()
 
 
 @login_manager.user_loader
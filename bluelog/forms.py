@@ -11,7 +11,7 @@ from wtforms import StringField, SubmitField, SelectField, TextAreaField, Valida
     BooleanField, PasswordField
 from wtforms.validators import DataRequired, Email, Length, Optional, URL
 
-from bluelog.models import Category
+from bluelog.categories import category_registry
 
 
 class LoginForm(FlaskForm):
@@ -29,16 +29,23 @@ class SettingForm(FlaskForm):
     submit = SubmitField()
 
 
+class CategoryField(SelectField):
+    """Select one of the categories, checked against the category registry instead of the choices list."""
+
+    def pre_validate(self, form):
+        if self.data not in category_registry():
+            raise ValueError(self.gettext('Not a valid choice'))
+
+
 class PostForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired(), Length(1, 60)])
-    category = SelectField('Category', coerce=int, default=1)
+    category = CategoryField('Category', coerce=int, default=1)
     body = CKEditorField('Body', validators=[DataRequired()])
     submit = SubmitField()
 
     def __init__(self, *args, **kwargs):
         super(PostForm, self).__init__(*args, **kwargs)
-        self.category.choices = [(category.id, category.name)
-                                 for category in Category.query.order_by(Category.name).all()]
+        self.category.choices = category_registry().choices
 
 
 class CategoryForm(FlaskForm):
@@ -46,7 +53,7 @@ class CategoryForm(FlaskForm):
     submit = SubmitField()
 
     def validate_name(self, field):
-        if Category.query.filter_by(name=field.data).first():
+        if category_registry().get_by_name(field.data) is not None:
             raise ValidationError('Name already in use.')
 
 
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import posixpath
+import re
+import shutil
+from collections import deque
+from html import escape, unescape
+
+try:
+    from urlparse import urlsplit, parse_qsl
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from flask import current_app
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+# the pages which are the same for every anonymous reader
+FROZEN_ENDPOINTS = {'blog.index', 'blog.about', 'blog.show_category', 'blog.show_post', 'blog.archive',
+                    'blog.show_archive'}
+# the only query arguments of those pages, the ones used by pagination
+FROZEN_ARGS = {'page', 'cursor'}
+
+link_re = re.compile(r'(?P<attr>\b(?:href|src))="(?P<url>[^"]*)"')
+
+
+class Freezer(object):
+    """Render public pages with the test client and save them as static files.
+
+    Links between frozen pages, static files and uploads are rewritten to
+    relative paths, the rest (admin, comments, AI, theme) still points to
+    the application.
+    """
+
+    def __init__(self, destination, base_url='http://localhost/'):
+        self.app = current_app._get_current_object()
+        self.destination = destination
+        self.client = self.app.test_client()
+        self.base_url = base_url
+        self.host = urlsplit(base_url).netloc
+        self.adapter = self.app.url_map.bind(self.host)
+        self.uploads_url = self.adapter.build('admin.get_image', {'filename': 'x'})[:-1]
+
+    def _match(self, url):
+        """Return the endpoint and view arguments of an internal page URL, or None."""
+        parts = urlsplit(url)
+        if parts.scheme not in ('', 'http', 'https') or parts.netloc not in ('', self.host):
+            return None
+        try:
+            endpoint, view_args = self.adapter.match(parts.path, method='GET')
+        except (HTTPException, RequestRedirect):
+            return None
+        args = dict(parse_qsl(parts.query))
+        if endpoint not in FROZEN_ENDPOINTS or not set(args) <= FROZEN_ARGS:
+            return None
+        return endpoint, view_args, args
+
+    @staticmethod
+    def canonical_url(url):
+        """The local URL without ``page=1``, which is the same page as no page at all."""
+        parts = urlsplit(url)
+        args = [arg for arg in parse_qsl(parts.query) if arg != ('page', '1')]
+        return parts._replace(scheme='', netloc='', query=urlencode(args)).geturl()
+
+    @staticmethod
+    def frozen_path(url):
+        """The file a page URL is saved to, e.g. ``post/1/page-2.html`` for ``/post/1?page=2``."""
+        parts = urlsplit(url)
+        directory = parts.path.strip('/')
+        args = sorted(parse_qsl(parts.query))
+        if not args:
+            return posixpath.join(directory, 'index.html')
+        name = '-'.join('%s-%s' % arg for arg in args)
+        return posixpath.join(directory, re.sub(r'[^\w-]', '_', name) + '.html')
+
+    def _file_path(self, url):
+        """The copied file of a static file or upload URL, or None."""
+        parts = urlsplit(url)
+        if parts.netloc not in ('', self.host) or parts.query:
+            return None
+        if parts.path.startswith(self.app.static_url_path + '/') or parts.path.startswith(self.uploads_url):
+            return parts.path.lstrip('/')
+        return None
+
+    def _rewrite(self, html, page_path):
+        """Point the links to frozen files at them with relative paths."""
+        page_directory = posixpath.dirname(page_path) or '.'
+        links = set()
+
+        def replace(match):
+            url = unescape(match.group('url'))
+            path, _, fragment = url.partition('#')
+            if path and self._match(path) is not None:
+                path = self.canonical_url(path)
+                links.add(path)
+                target = self.frozen_path(path)
+            else:
+                target = self._file_path(path)
+                if target is None:
+                    return match.group(0)
+            relative = posixpath.relpath(target, page_directory)
+            if fragment:
+                relative += '#' + fragment
+            return '%s="%s"' % (match.group('attr'), escape(relative))
+
+        return link_re.sub(replace, html), links
+
+    def _write(self, path, data):
+        filename = os.path.join(self.destination, *path.split('/'))
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                if f.read() == data:
+                    return False
+        directory = os.path.dirname(filename)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return True
+
+    def freeze(self, urls):
+        """Freeze the given pages and, following their pagination links, the pages after them.
+
+        Returns the number of pages which were written because they changed.
+        """
+        queue = deque(urls)
+        seen = set(urls)
+        written = 0
+        while queue:
+            url = queue.popleft()
+            response = self.client.get(url, base_url=self.base_url, environ_overrides={'bluelog.freezing': True})
+            if response.status_code != 200:
+                continue
+            path = self.frozen_path(url)
+            html, links = self._rewrite(response.get_data(as_text=True), path)
+            written += self._write(path, html.encode('utf-8'))
+
+            endpoint, view_args, _ = self._match(url)
+            for link in links:
+                # only walk the other pages of the same listing
+                if link not in seen and self._match(link)[:2] == (endpoint, view_args):
+                    seen.add(link)
+                    queue.append(link)
+        return written
+
+    def remove(self, url):
+        """Remove the frozen pages under a URL, e.g. the ones of a deleted post."""
+        directory = os.path.join(self.destination, *urlsplit(url).path.strip('/').split('/'))
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+    def copy_files(self):
+        """Copy the static files and the uploads which are missing or changed."""
+        upload_directory = self.uploads_url.strip('/').split('/')
+        for source, target in ((self.app.static_folder, self.app.static_url_path.strip('/').split('/')),
+                               (self.app.config['BLUELOG_UPLOAD_PATH'], upload_directory)):
+            target = os.path.join(self.destination, *target)
+            for root, _, filenames in os.walk(source):
+                for filename in filenames:
+                    source_file = os.path.join(root, filename)
+                    target_file = os.path.join(target, os.path.relpath(source_file, source))
+                    if os.path.exists(target_file) and \
+                            os.path.getsize(target_file) == os.path.getsize(source_file) and \
+                            os.path.getmtime(target_file) >= os.path.getmtime(source_file):
+                        continue
+                    if not os.path.exists(os.path.dirname(target_file)):
+                        os.makedirs(os.path.dirname(target_file))
+                    shutil.copy2(source_file, target_file)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from bluelog.utils import IMAGE_VARIANTS
+
+PROCESSED_FORMATS = {'JPEG', 'PNG'}
+
+
+def variant_directory(upload_path, filename):
+    return os.path.join(upload_path, 'variants', filename)
+
+
+def uploaded_files(upload_path):
+    """The paths of the uploaded files relative to ``upload_path``, the sharded ones and the older flat ones."""
+    for root, directories, filenames in os.walk(upload_path):
+        if root == upload_path and 'variants' in directories:
+            directories.remove('variants')
+        directories.sort()
+        for filename in sorted(filenames):
+            yield os.path.relpath(os.path.join(root, filename), upload_path).replace(os.sep, '/')
+
+
+def save_image(image, path, image_format, quality):
+    # written aside and moved, so a half written file is never served
+    temp_path = path + '.tmp'
+    image.save(temp_path, image_format, quality=quality, optimize=True)
+    os.replace(temp_path, path)
+
+
+def replace_directory(source, target):
+    if not os.path.isdir(target):
+        os.rename(source, target)
+        return
+    old = '%s.old%d' % (target, os.getpid())
+    os.rename(target, old)
+    os.rename(source, target)
+    shutil.rmtree(old)
+
+
+def process_image(upload_path, filename, quality=82):
+    """Strip the metadata of an uploaded image and write its resized and WebP variants.
+
+    The original is only stripped the first time, the later runs write the
+    variants again from it. The variants are written aside and their
+    directory moved in place last, so it only exists once they are all
+    written. Returns the count of files written, animated and other formats
+    are left as they are and served as uploaded.
+    """
+    path = os.path.join(upload_path, filename)
+    with Image.open(path) as uploaded:
+        image_format = uploaded.format
+        if image_format not in PROCESSED_FORMATS or getattr(uploaded, 'is_animated', False):
+            return 0
+        image = ImageOps.exif_transpose(uploaded)
+    # drop the EXIF data, the comments and the color profile
+    image.info = {key: value for key, value in image.info.items() if key == 'transparency'}
+
+    directory = variant_directory(upload_path, filename)
+    temp_directory = '%s.tmp%d' % (directory, os.getpid())
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    extension = filename.rsplit('.', 1)[1]
+    webp_mode = 'RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB'
+    try:
+        for variant, width in IMAGE_VARIANTS:
+            resized = image.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            save_image(resized, os.path.join(temp_directory, '%s.%s' % (variant, extension)), image_format, quality)
+            save_image(resized.convert(webp_mode), os.path.join(temp_directory, '%s.webp' % variant), 'WEBP', quality)
+        written = len(IMAGE_VARIANTS) * 2
+        if not os.path.isdir(directory):
+            save_image(image, path, image_format, quality)
+            written += 1
+        replace_directory(temp_directory, directory)
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+    return written
+
+
+class ImagePipeline(object):
+    """Process the uploaded images in a pool of ``BLUELOG_IMAGE_WORKERS`` processes.
+
+    At most ``BLUELOG_IMAGE_QUEUE_SIZE`` images wait for a worker, the later
+    ones are left to ``flask images``. With no workers the images are
+    processed in the request.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = None
+
+    def init_app(self, app):
+        self.app = app
+        self._slots = threading.BoundedSemaphore(app.config['BLUELOG_IMAGE_QUEUE_SIZE'])
+
+    def _get_executor(self):
+        with self._lock:
+            # a pool started before the worker processes were forked is not theirs
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.app.config['BLUELOG_IMAGE_WORKERS'])
+                self._pid = os.getpid()
+            return self._executor
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            self.app.logger.warning('Failed to process an uploaded image: %r', future.exception())
+
+    def submit(self, filename):
+        """Process the image in the background, returns False if the queue is full."""
+        args = (self.app.config['BLUELOG_UPLOAD_PATH'], filename, self.app.config['BLUELOG_IMAGE_QUALITY'])
+        if not self.app.config['BLUELOG_IMAGE_WORKERS']:
+            try:
+                process_image(*args)
+            except OSError as e:
+                self.app.logger.warning('Failed to process an uploaded image: %r', e)
+            return True
+        if not self._slots.acquire(blocking=False):
+            return False
+        self._get_executor().submit(process_image, *args).add_done_callback(self._done)
+        return True
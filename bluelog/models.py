@@ -5,12 +5,33 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+from collections import Counter, namedtuple
 from datetime import datetime
 
 from flask_login import UserMixin
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from bluelog.extensions import db
+from bluelog.revisions import compress_text, decompress_text, make_delta, apply_delta
+from bluelog.utils import clean_html, make_excerpt, responsive_images
+
+
+def add_to_counters(model, key, **deltas):
+    """Add ``deltas`` to the counters of the ``model`` row with the primary ``key``, which is created if missing.
+
+    The row is inserted in a savepoint, if another request inserted it
+    meanwhile the update applies again and the rest of the transaction stays.
+    """
+    query = model.query.filter_by(**key)
+    values = {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items()}
+    if query.update(values, synchronize_session='evaluate'):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **deltas))
+    except IntegrityError:
+        query.update(values, synchronize_session='evaluate')
 
 
 class Admin(db.Model, UserMixin):
@@ -32,32 +53,155 @@ class Admin(db.Model, UserMixin):
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique=True)
+    post_count = db.Column(db.Integer, default=0)
 
     posts = db.relationship('Post', back_populates='category')
 
     def delete(self):
-        default_category = Category.query.get(1)
-        posts = self.posts[:]
-        for post in posts:
-            post.category = default_category
-        db.session.delete(self)
+        # move the posts to the default category without loading them, the new
+        # updated_at expires the cached pages showing the old category
+        moved = Post.query.filter_by(category_id=self.id).update(
+            {Post.category_id: 1, Post.updated_at: datetime.utcnow()}, synchronize_session=False)
+        Category.query.filter_by(id=1).update({Category.post_count: Category.post_count + moved},
+                                              synchronize_session=False)
+        Category.query.filter_by(id=self.id).delete(synchronize_session='evaluate')
         db.session.commit()
 
+    @staticmethod
+    def update_post_counts():
+        post_count = db.select([db.func.count(Post.id)]).where(Post.category_id == Category.id).as_scalar()
+        Category.query.update({Category.post_count: post_count}, synchronize_session=False)
+
 
 class Post(db.Model):
+    __table_args__ = (
+        # the posts of a category, newest first
+        db.Index('ix_post_category_id_timestamp', 'category_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(60))
     body = db.Column(db.Text)
+    # derived from body when it is set, see render_post_body()
+    body_html = db.Column(db.Text)
+    excerpt = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     can_comment = db.Column(db.Boolean, default=True)
+    # reviewed comments only
+    comment_count = db.Column(db.Integer, default=0, index=True)
 
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
 
     category = db.relationship('Category', back_populates='posts')
     comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan')
 
+    def related_posts(self):
+        return Post.query.join(PostRelated, PostRelated.related_id == Post.id) \
+            .filter(PostRelated.post_id == self.id).order_by(PostRelated.rank) \
+            .options(db.defer(Post.body), db.defer(Post.body_html)).all()
+
+    @staticmethod
+    def update_comment_counts():
+        comment_count = db.select([db.func.count(Comment.id)]).where(
+            db.and_(Comment.post_id == Post.id, Comment.reviewed.is_(True))).as_scalar()
+        Post.query.update({Post.comment_count: comment_count}, synchronize_session=False)
+
+
+class PostRelated(db.Model):
+    """The most similar posts of a post, computed offline by ``flask related``."""
+    __tablename__ = 'post_related'
+
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, db.ForeignKey('post.id'), index=True)
+    score = db.Column(db.Float)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class PostRevision(db.Model):
+    """A saved version of a post, stored as a delta against the one before.
+
+    Every ``snapshot_interval`` revisions the whole body is stored instead, so
+    a body is rebuilt from at most that many rows.
+    """
+    __tablename__ = 'post_revision'
+    __table_args__ = (
+        db.Index('ix_post_revision_post_id_number', 'post_id', 'number', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    number = db.Column(db.Integer)
+    title = db.Column(db.String(60))
+    snapshot = db.Column(db.Boolean, default=False)
+    data = db.Column(db.LargeBinary)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def load_body(self):
+        start = db.session.query(db.func.max(PostRevision.number)).filter(
+            PostRevision.post_id == self.post_id, PostRevision.snapshot.is_(True),
+            PostRevision.number <= self.number).scalar()
+        body = ''
+        for revision in PostRevision.query.filter(PostRevision.post_id == self.post_id,
+                                                  PostRevision.number.between(start, self.number)) \
+                .order_by(PostRevision.number):
+            body = decompress_text(revision.data) if revision.snapshot else apply_delta(body, revision.data)
+        return body
+
+    @staticmethod
+    def record(post, snapshot_interval):
+        """Add the current title and body of the post as a revision, unless they are the last one saved."""
+        body = post.body or ''
+        previous = PostRevision.query.filter_by(post_id=post.id).order_by(PostRevision.number.desc()).first()
+        if previous is None:
+            number, snapshot = 1, True
+        else:
+            previous_body = previous.load_body()
+            if previous_body == body and previous.title == post.title:
+                return None
+            number = previous.number + 1
+            snapshot = (number - 1) % snapshot_interval == 0
+        revision = PostRevision(post_id=post.id, number=number, title=post.title, snapshot=snapshot,
+                                data=compress_text(body) if snapshot else make_delta(previous_body, body))
+        db.session.add(revision)
+        return revision
+
+
+class PostView(db.Model):
+    """The view count of each post, written in batches by the view counter."""
+    __tablename__ = 'post_views'
+
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True, autoincrement=False)
+    views = db.Column(db.Integer, default=0, index=True)
+
+    @staticmethod
+    def popular_posts(limit):
+        return db.session.query(Post.id, Post.title, PostView.views) \
+            .join(PostView, PostView.post_id == Post.id) \
+            .order_by(PostView.views.desc(), Post.id.desc()).limit(limit).all()
+
+
+@db.event.listens_for(Post.body, 'set', named=True)
+def render_post_body(**kwargs):
+    post = kwargs['target']
+    post.body_html = responsive_images(clean_html(kwargs['value']))
+    post.excerpt = make_excerpt(post.body_html)
+
 
 class Comment(db.Model):
+    __table_args__ = (
+        # the reviewed comments of a post, oldest first
+        db.Index('ix_comment_post_id_reviewed_timestamp', 'post_id', 'reviewed', 'timestamp', 'id'),
+        # the unread count and the filters of the comment management page
+        db.Index('ix_comment_reviewed_timestamp', 'reviewed', 'timestamp', 'id'),
+        db.Index('ix_comment_from_admin_timestamp', 'from_admin', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     author = db.Column(db.String(30))
     email = db.Column(db.String(254))
@@ -66,6 +210,7 @@ class Comment(db.Model):
     from_admin = db.Column(db.Boolean, default=False)
     reviewed = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     replied_id = db.Column(db.Integer, db.ForeignKey('comment.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
@@ -77,6 +222,173 @@ class Comment(db.Model):
     # replies = db.relationship('Comment', backref=db.backref('replied', remote_side=[id]),
     # cascade='all,delete-orphan')
 
+    @staticmethod
+    def thread_roots(post):
+        """The reviewed comments of a post which start a thread, the replies to a hidden comment included."""
+        parent = db.aliased(Comment)
+        return Comment.query.with_parent(post).filter(Comment.reviewed.is_(True)).outerjoin(
+            parent, db.and_(parent.id == Comment.replied_id, parent.post_id == Comment.post_id,
+                            parent.reviewed.is_(True))).filter(parent.id.is_(None))
+
+    @staticmethod
+    def load_tree(post, roots=None):
+        """Load the reviewed threads started by ``roots`` (all of them by default) with one recursive query.
+
+        Returns the ``CommentNode`` of each root, every node holding the nodes
+        of its replies in time order.
+        """
+        if roots is None:
+            anchor = Comment.thread_roots(post)
+        elif not roots:
+            return []
+        else:
+            anchor = Comment.query.filter(Comment.id.in_([comment.id for comment in roots]))
+        tree = anchor.with_entities(Comment.id, db.literal(0).label('depth')).cte('comment_tree', recursive=True)
+        reply = db.aliased(Comment)
+        tree = tree.union_all(db.session.query(reply.id, tree.c.depth + 1).filter(
+            reply.replied_id == tree.c.id, reply.post_id == post.id, reply.reviewed.is_(True)))
+        rows = db.session.query(Comment, tree.c.depth).join(tree, Comment.id == tree.c.id) \
+            .order_by(Comment.timestamp, Comment.id).all()
+
+        nodes = {comment.id: CommentNode(comment, []) for comment, _ in rows}
+        for comment, depth in rows:
+            if depth:
+                nodes[comment.replied_id].replies.append(nodes[comment.id])
+        if roots is None:
+            return [nodes[comment.id] for comment, depth in rows if not depth]
+        return [nodes[comment.id] for comment in roots]
+
+    @staticmethod
+    def approve_all(*criteria):
+        """Publish the unread comments matching ``criteria``, returns their count."""
+        criteria += (Comment.reviewed.is_(False),)
+        for day, count, _ in CommentDay.comment_days(*criteria):
+            CommentDay.count_comment(day, 0, -count)
+        approved = db.select([db.func.count(Comment.id)]).where(
+            db.and_(Comment.post_id == Post.id, *criteria)).as_scalar()
+        Post.query.filter(Post.id.in_(db.select([Comment.post_id]).where(db.and_(*criteria)))) \
+            .update({Post.comment_count: Post.comment_count + approved}, synchronize_session=False)
+        return Comment.query.filter(*criteria).update({Comment.reviewed: True}, synchronize_session=False)
+
+    @staticmethod
+    def delete_all(*criteria, batch_size=500):
+        """Delete the comments matching ``criteria`` and their replies of any depth, returns the count deleted."""
+        selected = db.session.query(Comment.id, db.literal(0).label('depth')).filter(*criteria) \
+            .cte('deleted_comment', recursive=True)
+        reply = db.aliased(Comment)
+        tree = selected.union_all(db.session.query(reply.id, selected.c.depth + 1)
+                                  .filter(reply.replied_id == selected.c.id))
+        rows = db.session.query(Comment.id, Comment.post_id, Comment.reviewed, Comment.timestamp) \
+            .filter(Comment.id.in_(db.select([tree.c.id]))).all()
+        depths = {}
+        for comment_id, depth in db.session.query(tree.c.id, tree.c.depth):
+            depths[comment_id] = max(depth, depths.get(comment_id, 0))
+
+        days = Counter((timestamp.date(), reviewed) for _, _, reviewed, timestamp in rows)
+        for (day, reviewed), count in days.items():
+            CommentDay.count_comment(day, -count, 0 if reviewed else -count)
+        removed = Counter(post_id for _, post_id, reviewed, _ in rows if reviewed and post_id is not None)
+        if removed:
+            post = Post.__table__
+            db.session.execute(
+                post.update().where(post.c.id == db.bindparam('removed_post_id'))
+                .values(comment_count=post.c.comment_count - db.bindparam('removed')),
+                [dict(removed_post_id=post_id, removed=count) for post_id, count in removed.items()])
+        # the replies before the comments they reply to, for the databases checking replied_id
+        levels = {}
+        for comment_id, depth in depths.items():
+            levels.setdefault(depth, []).append(comment_id)
+        for depth in sorted(levels, reverse=True):
+            comment_ids = levels[depth]
+            for start in range(0, len(comment_ids), batch_size):
+                Comment.query.filter(Comment.id.in_(comment_ids[start:start + batch_size])) \
+                    .delete(synchronize_session=False)
+        return len(rows)
+
+    def delete(self):
+        # the replies are deleted with the comment, keep the counters of their posts right
+        removed = Counter()
+        days = Counter()
+        comments = [self]
+        while comments:
+            comment = comments.pop()
+            if comment.reviewed and comment.post is not None:
+                removed[comment.post] += 1
+            days[comment.timestamp.date(), comment.reviewed] += 1
+            comments.extend(comment.replies)
+        for post, count in removed.items():
+            post.comment_count = Post.comment_count - count
+        for (day, reviewed), count in days.items():
+            CommentDay.count_comment(day, -count, 0 if reviewed else -count)
+        db.session.delete(self)
+        db.session.commit()
+
+
+CommentNode = namedtuple('CommentNode', ['comment', 'replies'])
+
+
+class ArchiveMonth(db.Model):
+    """The count of posts published in each month, kept up to date by the post handlers."""
+    __tablename__ = 'archive_month'
+
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    post_count = db.Column(db.Integer, default=0)
+
+    @staticmethod
+    def count_post(timestamp, delta=1):
+        add_to_counters(ArchiveMonth, dict(year=timestamp.year, month=timestamp.month), post_count=delta)
+
+    @staticmethod
+    def update_post_counts():
+        year, month = db.extract('year', Post.timestamp), db.extract('month', Post.timestamp)
+        counts = db.session.query(year, month, db.func.count(Post.id)) \
+            .filter(Post.timestamp.isnot(None)).group_by(year, month).all()
+        ArchiveMonth.query.delete(synchronize_session='evaluate')
+        db.session.add_all([ArchiveMonth(year=int(year), month=int(month), post_count=post_count)
+                            for year, month, post_count in counts])
+
+
+class CommentDay(db.Model):
+    """The count of comments and unread comments received each day, kept up to date by the comment handlers."""
+    __tablename__ = 'comment_day'
+
+    day = db.Column(db.Date, primary_key=True)
+    comment_count = db.Column(db.Integer, default=0)
+    unread_count = db.Column(db.Integer, default=0)
+
+    @staticmethod
+    def count_comment(day, comments=1, unread=0):
+        if isinstance(day, datetime):
+            day = day.date()
+        add_to_counters(CommentDay, dict(day=day), comment_count=comments, unread_count=unread)
+
+    @staticmethod
+    def comment_days(*criteria):
+        """The day, the count and the unread count of the comments matching ``criteria``."""
+        day = db.func.date(Comment.timestamp, type_=db.Date)
+        unread = db.func.sum(db.case([(Comment.reviewed.is_(False), 1)], else_=0))
+        return db.session.query(day, db.func.count(Comment.id), unread).filter(*criteria).group_by(day).all()
+
+    @staticmethod
+    def update_comment_counts():
+        CommentDay.query.delete(synchronize_session='evaluate')
+        db.session.add_all([CommentDay(day=day, comment_count=count, unread_count=unread)
+                            for day, count, unread in CommentDay.comment_days(Comment.timestamp.isnot(None))])
+
+
+class Upload(db.Model):
+    """An uploaded file, stored once under the SHA-256 digest of its content however many times it is uploaded."""
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), unique=True, index=True)
+    filename = db.Column(db.String(80))
+    original_name = db.Column(db.String(255))
+    size = db.Column(db.Integer)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, default=1)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 class Link(db.Model):
     id = db.Column(db.Integer, primary_key=True)
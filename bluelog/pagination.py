@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from flask import request, current_app, abort
+
+
+class KeysetPagination(object):
+    """A page of items fetched after (or before) a ``(timestamp, id)`` cursor.
+
+    Unlike the offset pagination no row before the page is scanned, and the
+    total is only counted when a template asks for it.
+    """
+
+    def __init__(self, query, items, has_prev, has_next, column):
+        self.query = query
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = encode_cursor('p', items[0], column) if has_prev and items else None
+        self.next_cursor = encode_cursor('n', items[-1], column) if has_next and items else None
+        self._total = None
+
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = self.query.order_by(None).count()
+        return self._total
+
+
+def encode_cursor(direction, item, column):
+    value = '%s%s|%d' % (direction, getattr(item, column.key).isoformat(), item.id)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, item_id = value[1:].split('|')
+        return value[0], datetime.fromisoformat(timestamp), int(item_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(404)
+
+
+def paginate_keyset(query, column, cursor, per_page, descending=True):
+    id_column = column.class_.id
+    cursor = cursor or None  # an empty ?cursor= is the first page
+    if cursor == 'last':  # the last page, e.g. the latest comments
+        direction, after = 'p', None
+    elif cursor:
+        direction, timestamp, item_id = decode_cursor(cursor)
+        if direction not in ('n', 'p'):
+            abort(404)
+        # going backwards is walking the reversed order forwards
+        after = (column < timestamp) | ((column == timestamp) & (id_column < item_id))
+        if descending == (direction == 'p'):
+            after = (column > timestamp) | ((column == timestamp) & (id_column > item_id))
+    else:
+        direction, after = 'n', None
+
+    reverse = descending == (direction == 'p')
+    order = (column.asc(), id_column.asc()) if reverse else (column.desc(), id_column.desc())
+    page_query = query.order_by(*order)
+    if after is not None:
+        page_query = page_query.filter(after)
+    items = page_query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == 'p':
+        items.reverse()
+        return KeysetPagination(query, items, has_more, cursor != 'last', column)
+    return KeysetPagination(query, items, cursor is not None, has_more, column)
+
+
+def paginate(query, column, per_page, descending=True):
+    """Paginate ``query`` ordered by ``column`` and the id, with the page from the request."""
+    if current_app.config['BLUELOG_KEYSET_PAGINATION']:
+        return paginate_keyset(query, column, request.args.get('cursor'), per_page, descending)
+    id_column = column.class_.id
+    order = (column.desc(), id_column.desc()) if descending else (column.asc(), id_column.asc())
+    page = request.args.get('page', 1, type=int)
+    return query.order_by(*order).paginate(page, per_page)
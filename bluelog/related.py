@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from markupsafe import Markup
+
+from bluelog.extensions import db
+from bluelog.models import Post, PostRelated
+
+word_re = re.compile(r'[^\W\d_]{2,}', re.UNICODE)
+
+
+def tokenize(text):
+    return [word.lower() for word in word_re.findall(text)]
+
+
+class TfidfIndex(object):
+    """Sparse TF-IDF vectors of the posts, with an inverted index to find the similar ones.
+
+    The cosine similarity of a post to all the others is the sum of the weight
+    products over the posting lists of its terms, so only the posts sharing a
+    term are visited. Terms in more than ``max_df`` of the posts are dropped,
+    they say little and have the longest lists.
+    """
+
+    def __init__(self, documents, max_df=0.5):
+        counts = {post_id: Counter(tokenize(text)) for post_id, text in documents}
+        document_frequency = Counter(term for terms in counts.values() for term in terms)
+        total = len(counts)
+        idf = {term: math.log((1 + total) / (1 + df)) + 1
+               for term, df in document_frequency.items() if df <= max_df * total}
+
+        self.vectors = {}
+        self.postings = defaultdict(list)
+        for post_id, terms in counts.items():
+            vector = {term: (1 + math.log(count)) * idf[term] for term, count in terms.items() if term in idf}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1
+            vector = {term: weight / norm for term, weight in vector.items()}
+            self.vectors[post_id] = vector
+            for term, weight in vector.items():
+                self.postings[term].append((post_id, weight))
+
+    def similarities(self, post_id):
+        scores = defaultdict(float)
+        for term, weight in self.vectors.get(post_id, {}).items():
+            for other_id, other_weight in self.postings[term]:
+                scores[other_id] += weight * other_weight
+        scores.pop(post_id, None)
+        return scores
+
+    def neighbours(self, post_id, k):
+        return heapq.nlargest(k, self.similarities(post_id).items(), key=lambda item: (item[1], -item[0]))
+
+
+def post_documents():
+    query = db.session.query(Post.id, Post.title, Post.body_html, Post.body).order_by(Post.id).yield_per(1000)
+    for post_id, title, body_html, body in query:
+        yield post_id, '%s %s' % (title or '', Markup(body_html if body_html is not None else body or '').striptags())
+
+
+def touched_posts(index, changed_ids, k):
+    """The posts whose neighbours may change because the ``changed_ids`` posts were written."""
+    current = defaultdict(dict)
+    referrers = defaultdict(set)
+    for post_id, related_id, score in db.session.query(PostRelated.post_id, PostRelated.related_id,
+                                                       PostRelated.score):
+        current[post_id][related_id] = score
+        referrers[related_id].add(post_id)
+
+    touched = set(changed_ids)
+    for post_id, related in current.items():
+        # a neighbour was deleted
+        if any(related_id not in index.vectors for related_id in related):
+            touched.add(post_id)
+    for changed_id in changed_ids:
+        touched.update(referrers[changed_id])
+        for post_id, score in index.similarities(changed_id).items():
+            related = current.get(post_id, {})
+            if len(related) < k or score > min(related.values()):
+                touched.add(post_id)
+    return touched & set(index.vectors)
+
+
+def update_related_posts(k, full=False, batch_size=500):
+    """Store the ``k`` most similar posts of each post, returns the count of posts updated.
+
+    Unless ``full`` is set, only the posts written since the last update and
+    the posts whose neighbours they may change are computed again.
+    """
+    started = datetime.utcnow()
+    index = TfidfIndex(post_documents())
+    last_update = None if full else db.session.query(db.func.max(PostRelated.computed_at)).scalar()
+    if last_update is None:
+        post_ids = set(index.vectors)
+        PostRelated.query.delete(synchronize_session=False)
+    else:
+        changed_ids = {post_id for post_id, in db.session.query(Post.id).filter(Post.updated_at >= last_update)}
+        post_ids = touched_posts(index, changed_ids, k)
+
+    post_ids = sorted(post_ids)
+    for start in range(0, len(post_ids), batch_size):
+        batch = post_ids[start:start + batch_size]
+        PostRelated.query.filter(PostRelated.post_id.in_(batch)).delete(synchronize_session=False)
+        rows = [dict(post_id=post_id, rank=rank, related_id=related_id, score=score, computed_at=started)
+                for post_id in batch
+                for rank, (related_id, score) in enumerate(index.neighbours(post_id, k), 1)]
+        if rows:
+            db.session.execute(PostRelated.__table__.insert(), rows)
+        db.session.commit()
+    return len(post_ids)
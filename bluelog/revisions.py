@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import difflib
+import json
+import zlib
+
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decompress_text(data):
+    return zlib.decompress(data).decode('utf-8')
+
+
+def make_delta(old, new):
+    """The compressed line delta turning ``old`` into ``new``.
+
+    A delta is a list of the ``[start, end]`` line ranges copied from the old
+    text and the strings inserted between them, so its size follows the size
+    of the edit.
+    """
+    old_lines, new_lines = old.splitlines(True), new.splitlines(True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 < j2:
+            ops.append(''.join(new_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode('utf-8'))
+
+
+def apply_delta(old, delta):
+    old_lines = old.splitlines(True)
+    return ''.join(''.join(old_lines[op[0]:op[1]]) if isinstance(op, list) else op
+                   for op in json.loads(decompress_text(delta)))
+
+
+def diff_lines(old, new, context=3):
+    """The lines of the unified diff with the CSS class of each one."""
+    classes = {'+': 'diff-insert', '-': 'diff-delete', '@': 'diff-hunk'}
+    lines = difflib.unified_diff(old.splitlines(), new.splitlines(), n=context, lineterm='')
+    return [(classes.get(line[:1], ''), line) for line in list(lines)[2:]]
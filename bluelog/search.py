@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+
+from markupsafe import Markup, escape
+
+# markers put around the matched terms by SQLite, replaced after the text is escaped
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+SearchHit = namedtuple('SearchHit', ['post_id', 'title', 'snippet'])
+
+token_re = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+def parse_query(q):
+    """Turn the words and "quoted phrases" of a reader into an FTS5 query matching all of them.
+
+    Every word is quoted, so the FTS5 operators and punctuation typed by the
+    reader are searched as plain text instead of raising syntax errors.
+    """
+    phrases = []
+    for phrase, word in token_re.findall(q):
+        text = ' '.join((phrase or word).replace('"', ' ').split())
+        if text:
+            phrases.append('"%s"' % text)
+    return ' '.join(phrases)
+
+
+def highlight(text):
+    return Markup(str(escape(text)).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+
+def post_text(post):
+    return Markup(post.body_html if post.body_html is not None else post.body or '').striptags()
+
+
+class SearchIndex(object):
+    """Inverted index of the post titles and bodies, kept in an SQLite FTS5 table.
+
+    The index lives in its own file, it is ranked with BM25 (the title weighs
+    more than the body) and answers phrase queries without scanning the posts.
+    """
+
+    def __init__(self, app=None):
+        self.path = None
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config['BLUELOG_SEARCH_INDEX']
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            if self.path != ':memory:':
+                connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS post_index "
+                               "USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')")
+            self._local.connection = connection
+        return connection
+
+    def add(self, post):
+        """Index a new or an edited post."""
+        with self.connection as connection:
+            connection.execute('DELETE FROM post_index WHERE rowid = ?', (post.id,))
+            connection.execute('INSERT INTO post_index (rowid, title, body) VALUES (?, ?, ?)',
+                               (post.id, post.title, post_text(post)))
+
+    def remove(self, post_id):
+        with self.connection as connection:
+            connection.execute('DELETE FROM post_index WHERE rowid = ?', (post_id,))
+
+    def rebuild(self, posts):
+        """Replace the whole index with ``posts``, returns the count of indexed posts."""
+        rows = ((post.id, post.title, post_text(post)) for post in posts)
+        with self.connection as connection:
+            connection.execute('DELETE FROM post_index')
+            connection.executemany('INSERT INTO post_index (rowid, title, body) VALUES (?, ?, ?)', rows)
+            # merge the segments written by the inserts into one b-tree
+            connection.execute("INSERT INTO post_index (post_index) VALUES ('optimize')")
+            return connection.execute('SELECT count(*) FROM post_index').fetchone()[0]
+
+    def search(self, q, page=1, per_page=10):
+        """Return the total of matched posts and the hits of a page, best ranked first."""
+        query = parse_query(q)
+        if not query:
+            return 0, []
+        connection = self.connection
+        total = connection.execute('SELECT count(*) FROM post_index WHERE post_index MATCH ?', (query,)).fetchone()[0]
+        rows = connection.execute(
+            "SELECT rowid, highlight(post_index, 0, ?, ?), snippet(post_index, 1, ?, ?, '...', 32) "
+            "FROM post_index WHERE post_index MATCH ? ORDER BY bm25(post_index, 10.0, 1.0) LIMIT ? OFFSET ?",
+            (MATCH_START, MATCH_END, MATCH_START, MATCH_END, query, per_page, (page - 1) * per_page))
+        return total, [SearchHit(post_id, highlight(title), highlight(snippet)) for post_id, title, snippet in rows]
@@ -7,6 +7,7 @@
 """
 import os
 import sys
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
@@ -40,19 +41,51 @@ class BaseConfig(object):
     BLUELOG_POST_PER_PAGE = 10
     BLUELOG_MANAGE_POST_PER_PAGE = 15
     BLUELOG_COMMENT_PER_PAGE = 15
+    # walk the listings with (timestamp, id) cursors instead of page numbers
+    BLUELOG_KEYSET_PAGINATION = False
     # ('theme name', 'display name')
     BLUELOG_THEMES = {'perfect_blue': 'Perfect Blue', 'black_swan': 'Black Swan'}
     BLUELOG_SLOW_QUERY_THRESHOLD = 1
+    # version stamps shared by all the worker processes
+    BLUELOG_CACHE_PATH = os.path.join(basedir, 'cache')
+    BLUELOG_PAGE_CACHE = True
+    BLUELOG_PAGE_CACHE_SIZE = 500
+    BLUELOG_SEARCH_INDEX = os.path.join(basedir, 'search.sqlite')
+    BLUELOG_SEARCH_RESULT_PER_PAGE = 10
+    BLUELOG_FEED_ITEMS = 20
+    BLUELOG_RELATED_POSTS = 5
+    BLUELOG_POPULAR_POSTS = 5
+    BLUELOG_REVISION_SNAPSHOT_INTERVAL = 20
+    # views are buffered in each worker and written when either limit is reached
+    BLUELOG_VIEW_FLUSH_THRESHOLD = 100
+    BLUELOG_VIEW_FLUSH_INTERVAL = 10
+    # the limit of URLs in a sitemap file, above it sitemap.xml becomes an index of shards
+    BLUELOG_SITEMAP_SHARD_SIZE = 50000
+    # put the whole post in the feeds instead of the excerpt
+    BLUELOG_FEED_FULL_BODY = False
 
     AI_API_KEY = os.getenv('AI_API_KEY', '')
     AI_BASE_URL = os.getenv('AI_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
     AI_MODEL = os.getenv('AI_MODEL', 'deepseek-r1-0528')
 
     BLUELOG_UPLOAD_PATH = os.path.join(basedir, 'uploads')
+    BLUELOG_FREEZE_PATH = os.path.join(basedir, 'frozen')
     BLUELOG_ALLOWED_IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif']
+    # resizing the uploaded images, 0 workers process them in the request
+    BLUELOG_IMAGE_WORKERS = 2
+    BLUELOG_IMAGE_QUEUE_SIZE = 20
+    BLUELOG_IMAGE_QUALITY = 82
+    # the uploads named after their content are cached for a year
+    BLUELOG_UPLOAD_MAX_AGE = 365 * 24 * 3600
+    # None sends the uploads from Flask, 'x-sendfile' and 'x-accel-redirect' leave it to the web server,
+    # nginx needs an internal location for the prefix:
+    #     location /protected-uploads/ { internal; alias /path/to/bluelog/uploads/; }
+    BLUELOG_UPLOAD_SENDFILE = os.getenv('BLUELOG_UPLOAD_SENDFILE')
+    BLUELOG_UPLOAD_ACCEL_PREFIX = '/protected-uploads/'
 
 
 class DevelopmentConfig(BaseConfig):
+    BLUELOG_PAGE_CACHE = False
     SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir, 'data-dev.db')
 
 
@@ -60,6 +93,11 @@ class TestingConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # in-memory database
+    BLUELOG_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'bluelog-test-cache')
+    BLUELOG_SEARCH_INDEX = ':memory:'
+    BLUELOG_VIEW_FLUSH_INTERVAL = 3600
+    BLUELOG_UPLOAD_PATH = os.path.join(tempfile.gettempdir(), 'bluelog-test-uploads')
+    BLUELOG_IMAGE_WORKERS = 0
 
 
 class ProductionConfig(BaseConfig):
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import glob
+import hashlib
+import io
+import os
+
+from flask import current_app, request, url_for
+from markupsafe import escape
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def w3c_datetime(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def url_entry(loc, lastmod=None):
+    if lastmod is None:
+        return '<url><loc>%s</loc></url>\n' % escape(loc)
+    return '<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (escape(loc), w3c_datetime(lastmod))
+
+
+def stream(query):
+    """Fetch the rows in batches, with a server-side cursor where the database has one."""
+    return query.execution_options(stream_results=True).yield_per(1000)
+
+
+def page_urls():
+    yield url_entry(url_for('blog.index', _external=True))
+    yield url_entry(url_for('blog.about', _external=True))
+    for category_id, in stream(db.session.query(Category.id).order_by(Category.id)):
+        yield url_entry(url_for('blog.show_category', category_id=category_id, _external=True))
+
+
+def post_urls(first_id=None, last_id=None):
+    query = db.session.query(Post.id, Post.updated_at).order_by(Post.id)
+    if first_id is not None:
+        query = query.filter(Post.id.between(first_id, last_id))
+    for post_id, updated_at in stream(query):
+        yield url_entry(url_for('blog.show_post', post_id=post_id, _external=True), updated_at)
+
+
+def urlset(*parts):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="%s">\n' % SITEMAP_NS
+    for part in parts:
+        for entry in part:
+            yield entry
+    yield '</urlset>\n'
+
+
+def sitemap_index(sitemaps):
+    """The index of ``(url, lastmod)`` sitemaps."""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="%s">\n' % SITEMAP_NS
+    for loc, lastmod in sitemaps:
+        if lastmod is None:
+            yield '<sitemap><loc>%s</loc></sitemap>\n' % escape(loc)
+        else:
+            yield '<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n' % (escape(loc), w3c_datetime(lastmod))
+    yield '</sitemapindex>\n'
+
+
+def category_version():
+    return db.session.query(db.func.count(Category.id), db.func.sum(Category.id)).one()
+
+
+def post_shards(size):
+    """The number, the post count and the last change of each shard of ``size`` post ids."""
+    # the remainder taken off, the division is exact whether the database divides integers or not
+    offset = Post.id - 1
+    shard = (db.cast((offset - offset % size) / size, db.Integer) + 1).label('shard')
+    return db.session.query(shard, db.func.count(Post.id), db.func.max(Post.updated_at)) \
+        .group_by(shard).order_by(shard).all()
+
+
+def shard_range(shard, size):
+    return (shard - 1) * size + 1, shard * size
+
+
+def shard_version(shard, size):
+    return db.session.query(db.func.count(Post.id), db.func.max(Post.updated_at)) \
+        .filter(Post.id.between(*shard_range(shard, size))).one()
+
+
+def cached_sitemap(name, version, generate):
+    """Return the file of the sitemap ``name``, writing it with ``generate`` if its version changed.
+
+    The files are shared by the worker processes, and a shard is only written
+    again when the posts in its range change. Only the older versions of the
+    same host are removed.
+    """
+    # the URLs are absolute, each host has its own files
+    host = hashlib.sha1(request.host_url.encode('utf-8')).hexdigest()[:16]
+    directory = os.path.join(current_app.config['BLUELOG_CACHE_PATH'], 'sitemaps', host)
+    digest = hashlib.sha1(repr(version).encode('utf-8')).hexdigest()
+    path = os.path.join(directory, 'sitemap-%s-%s.xml' % (name, digest))
+    if os.path.exists(path):
+        return path
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = '%s.%d' % (path, os.getpid())
+    with io.open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(generate())
+    os.replace(tmp_path, path)
+    for old_path in glob.glob(os.path.join(directory, 'sitemap-%s-*.xml' % name)):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:  # removed by another worker
+                pass
+    return path
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category, Comment, ArchiveMonth, CommentDay
+
+
+def refresh_post_stats():
+    post_year, post_month = db.extract('year', Post.timestamp), db.extract('month', Post.timestamp)
+    categories, months = Counter(), Counter()
+    for category_id, year, month, count in db.session.query(Post.category_id, post_year, post_month,
+                                                            db.func.count(Post.id)) \
+            .group_by(Post.category_id, post_year, post_month):
+        categories[category_id] += count
+        if year is not None:
+            months[int(year), int(month)] += count
+
+    category = Category.__table__
+    Category.query.update({Category.post_count: 0}, synchronize_session=False)
+    if categories:
+        db.session.execute(category.update().where(category.c.id == db.bindparam('category_id'))
+                           .values(post_count=db.bindparam('count')),
+                           [dict(category_id=category_id, count=count) for category_id, count in categories.items()])
+    ArchiveMonth.query.delete(synchronize_session='evaluate')
+    db.session.add_all([ArchiveMonth(year=year, month=month, post_count=count)
+                        for (year, month), count in months.items()])
+
+
+def refresh_comment_stats():
+    comment_day = db.func.date(Comment.timestamp, type_=db.Date)
+    posts, days = Counter(), {}
+    for post_id, day, reviewed, count in db.session.query(Comment.post_id, comment_day, Comment.reviewed,
+                                                          db.func.count(Comment.id)) \
+            .group_by(Comment.post_id, comment_day, Comment.reviewed):
+        if reviewed and post_id is not None:
+            posts[post_id] += count
+        if day is None:
+            continue
+        stats = days.setdefault(day, CommentDay(day=day, comment_count=0, unread_count=0))
+        stats.comment_count += count
+        if not reviewed:
+            stats.unread_count += count
+
+    stored = dict(db.session.query(Post.id, Post.comment_count).filter(Post.comment_count != 0))
+    changed = [dict(post_id=post_id, count=posts[post_id]) for post_id in set(stored) | set(posts)
+               if stored.get(post_id, 0) != posts[post_id]]
+    if changed:
+        # a recount changes no post, updated_at stays as it is for the ETags, the feeds and the sitemap
+        post = Post.__table__
+        db.session.execute(post.update().where(post.c.id == db.bindparam('post_id'))
+                           .values(comment_count=db.bindparam('count'), updated_at=post.c.updated_at), changed)
+    CommentDay.query.delete(synchronize_session='evaluate')
+    db.session.add_all(days.values())
+
+
+def refresh_stats():
+    """Compute all the counters again with one grouped query over each of the post and the comment tables."""
+    refresh_post_stats()
+    refresh_comment_stats()
+    db.session.commit()
+
+
+def dashboard_stats(days=30, top=10):
+    """The statistics of the dashboard, read from the counters only."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    comment_days = {stats.day: stats for stats in CommentDay.query.filter(CommentDay.day >= since)}
+    backlog, oldest_unread = db.session.query(db.func.sum(CommentDay.unread_count),
+                                              db.func.min(CommentDay.day)) \
+        .filter(CommentDay.unread_count > 0).one()
+    return dict(
+        categories=Category.query.order_by(Category.post_count.desc(), Category.name).all(),
+        comment_days=[(day, comment_days[day].comment_count if day in comment_days else 0)
+                      for day in (since + timedelta(days=i) for i in range(days))],
+        backlog=backlog or 0,
+        oldest_unread=oldest_unread,
+        top_posts=Post.query.filter(Post.comment_count > 0).order_by(Post.comment_count.desc(), Post.id.desc())
+        .options(db.defer(Post.body), db.defer(Post.body_html)).limit(top).all()
+    )
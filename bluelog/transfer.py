@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import os
+from datetime import datetime
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category, Comment, Link
+from bluelog.utils import clean_html, make_excerpt, responsive_images
+
+# in the order they are written and imported, so the rows a record refers to come first
+RECORD_TYPES = [
+    ('category', Category, ['id', 'name']),
+    ('post', Post, ['id', 'title', 'timestamp', 'updated_at', 'can_comment', 'category_id', 'body']),
+    ('comment', Comment, ['id', 'author', 'email', 'site', 'body', 'from_admin', 'reviewed', 'timestamp',
+                          'updated_at', 'replied_id', 'post_id']),
+    ('link', Link, ['id', 'name', 'url']),
+]
+DATETIME_FIELDS = {'timestamp', 'updated_at'}
+
+
+def export_records(batch_size=1000):
+    """All the records of the blog, fetched in batches with a server-side cursor where the database has one."""
+    for record_type, model, fields in RECORD_TYPES:
+        query = db.session.query(*[getattr(model, field) for field in fields]).order_by(model.id)
+        for row in query.execution_options(stream_results=True).yield_per(batch_size):
+            record = {'type': record_type}
+            for field, value in zip(fields, row):
+                record[field] = value.isoformat() if isinstance(value, datetime) else value
+            yield record
+
+
+def write_jsonl(records, fp):
+    count = 0
+    for count, record in enumerate(records, 1):
+        fp.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return count
+
+
+def read_jsonl(fp):
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
+
+
+def front_matter_path(path, post_id):
+    return os.path.join(path, 'posts', '%08d.md' % post_id)
+
+
+def write_markdown(records, path):
+    """Write each post as a Markdown file with a front matter, the other records as JSONL files beside."""
+    os.makedirs(os.path.join(path, 'posts'), exist_ok=True)
+    files = {}
+    count = 0
+    try:
+        for count, record in enumerate(records, 1):
+            record_type = record.pop('type')
+            if record_type == 'post':
+                body = record.pop('body') or ''
+                with open(front_matter_path(path, record['id']), 'w', encoding='utf-8') as f:
+                    # the values are JSON, which is YAML too
+                    f.write('---\n')
+                    f.writelines('%s: %s\n' % (key, json.dumps(value, ensure_ascii=False))
+                                 for key, value in record.items())
+                    f.write('---\n')
+                    f.write(body)
+                continue
+            if record_type not in files:
+                files[record_type] = open(os.path.join(path, '%ss.jsonl' % record_type), 'w', encoding='utf-8')
+            files[record_type].write(json.dumps(record, ensure_ascii=False) + '\n')
+    finally:
+        for f in files.values():
+            f.close()
+    return count
+
+
+def read_post(filename):
+    with open(filename, encoding='utf-8') as f:
+        if f.readline() != '---\n':
+            raise ValueError('%s has no front matter.' % filename)
+        record = {'type': 'post'}
+        for line in f:
+            if line == '---\n':
+                break
+            key, value = line.split(': ', 1)
+            record[key] = json.loads(value)
+        record['body'] = f.read()
+    return record
+
+
+def read_markdown(path):
+    for record_type, _, _ in RECORD_TYPES:
+        if record_type == 'post':
+            for filename in sorted(os.listdir(os.path.join(path, 'posts'))):
+                if filename.endswith('.md'):
+                    yield read_post(os.path.join(path, 'posts', filename))
+            continue
+        filename = os.path.join(path, '%ss.jsonl' % record_type)
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                for record in read_jsonl(f):
+                    record['type'] = record_type
+                    yield record
+
+
+def to_row(record, fields):
+    row = {field: record.get(field) for field in fields}
+    for field in DATETIME_FIELDS & set(fields):
+        if row[field] is not None:
+            row[field] = datetime.fromisoformat(row[field])
+    if record['type'] == 'post':  # the bulk insert skips the attribute event rendering them
+        row['body_html'] = responsive_images(clean_html(row['body']))
+        row['excerpt'] = make_excerpt(row['body_html'])
+    return row
+
+
+def read_checkpoint(checkpoint):
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as f:
+        return json.load(f)['records']
+
+
+def write_checkpoint(checkpoint, count):
+    if checkpoint is None:
+        return
+    with open(checkpoint + '.tmp', 'w') as f:
+        json.dump({'records': count}, f)
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+
+def import_records(records, batch_size=5000, checkpoint=None):
+    """Insert the records in batches of ``batch_size`` rows, returns the count of records read.
+
+    The count of records committed is saved to the ``checkpoint`` file after
+    each batch, an import started again with it skips them.
+    """
+    tables = {record_type: (model.__table__, fields) for record_type, model, fields in RECORD_TYPES}
+    skip = read_checkpoint(checkpoint)
+    count, batch, batch_type = 0, [], None
+
+    def flush():
+        if batch:
+            table, fields = tables[batch_type]
+            db.session.execute(table.insert(), [to_row(record, fields) for record in batch])
+            db.session.commit()
+            del batch[:]
+        write_checkpoint(checkpoint, count)
+
+    for record in records:
+        if count < skip:
+            count += 1
+            continue
+        if record['type'] != batch_type or len(batch) >= batch_size:
+            flush()
+            batch_type = record['type']
+        batch.append(record)
+        count += 1
+    flush()
+    return count
+
+
+def reset_sequences():
+    """Move the id sequences of PostgreSQL past the imported ids, the other databases need nothing."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for _, model, _ in RECORD_TYPES:
+        table = model.__tablename__
+        db.session.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                           "COALESCE((SELECT MAX(id) FROM %s), 0) + 1, false)" % (table, table))
+    db.session.commit()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+from PIL import Image
+from flask import current_app, send_from_directory, safe_join, abort
+from sqlalchemy.exc import IntegrityError
+from werkzeug.urls import url_quote
+
+from bluelog.extensions import db
+from bluelog.images import variant_directory
+from bluelog.models import Upload
+
+CHUNK_SIZE = 64 * 1024
+SENDFILE_MODES = {None, 'x-sendfile', 'x-accel-redirect'}
+sharded_path_re = re.compile(r'(?:variants/)?([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.[a-z]+'
+                             r'(?:/[a-z]+\.[a-z]+)?$')
+
+
+def shard_path(digest, extension):
+    """The path of a stored file, two levels of directories named after the start of its digest."""
+    return '%s/%s/%s.%s' % (digest[:2], digest[2:4], digest, extension)
+
+
+def receive_file(stream, directory):
+    """Copy the stream to a temporary file in ``directory`` chunk by chunk.
+
+    Returns the path of the file, the SHA-256 digest and the size of its content.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.upload', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+def add_reference(digest):
+    Upload.query.filter_by(digest=digest).update({Upload.ref_count: Upload.ref_count + 1},
+                                                 synchronize_session=False)
+    db.session.commit()
+    return Upload.query.filter_by(digest=digest).one()
+
+
+def store_upload(file_storage, upload_path):
+    """Store an uploaded image under the digest of its content, once however many times it is uploaded.
+
+    Returns the ``Upload`` and whether the file is new, or ``None`` and
+    ``False`` if it is not an image.
+    """
+    os.makedirs(upload_path, exist_ok=True)
+    temp_path, digest, size = receive_file(file_storage.stream, upload_path)
+    try:
+        with Image.open(temp_path) as image:
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        os.remove(temp_path)
+        return None, False
+
+    if Upload.query.filter_by(digest=digest).count():
+        os.remove(temp_path)
+        return add_reference(digest), False
+
+    # the digest is the one of the file as uploaded, the image pipeline strips it later
+    filename = shard_path(digest, file_storage.filename.rsplit('.', 1)[1].lower())
+    path = os.path.join(upload_path, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    upload = Upload(digest=digest, filename=filename, original_name=file_storage.filename,
+                    size=size, width=width, height=height)
+    db.session.add(upload)
+    try:
+        db.session.commit()
+    except IntegrityError:  # the same file stored by another request meanwhile
+        db.session.rollback()
+        return add_reference(digest), False
+    return upload, True
+
+
+def init_uploads(app):
+    """Check how the uploads are sent, an empty ``BLUELOG_UPLOAD_SENDFILE`` is Flask sending them."""
+    sendfile = app.config['BLUELOG_UPLOAD_SENDFILE'] = app.config['BLUELOG_UPLOAD_SENDFILE'] or None
+    if sendfile not in SENDFILE_MODES:
+        raise ValueError('BLUELOG_UPLOAD_SENDFILE is %r, it must be x-sendfile, x-accel-redirect or empty.'
+                         % sendfile)
+
+
+def is_immutable(upload_path, filename):
+    """Whether the file is named after its content and done with by the image pipeline, so it never changes."""
+    if sharded_path_re.match(filename) is None:
+        return False
+    return filename.startswith('variants/') or os.path.isdir(variant_directory(upload_path, filename))
+
+
+def send_upload(upload_path, filename, cache_timeout=None):
+    """Send an uploaded file, or only the header telling the web server which one to send.
+
+    The files which never change are cached for ``BLUELOG_UPLOAD_MAX_AGE``
+    seconds without revalidation, Flask and the web servers answer the
+    conditional and the range requests of the others.
+    """
+    immutable = cache_timeout is None and is_immutable(upload_path, filename)
+    if immutable:
+        cache_timeout = current_app.config['BLUELOG_UPLOAD_MAX_AGE']
+    sendfile = current_app.config['BLUELOG_UPLOAD_SENDFILE']
+    if sendfile is None:
+        response = send_from_directory(upload_path, filename, cache_timeout=cache_timeout)
+    else:
+        path = safe_join(upload_path, filename)
+        if not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = current_app.response_class(mimetype=mimetype)
+        if sendfile == 'x-accel-redirect':
+            prefix = current_app.config['BLUELOG_UPLOAD_ACCEL_PREFIX']
+            response.headers['X-Accel-Redirect'] = prefix + url_quote(filename)
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.get_send_file_max_age(filename) \
+            if cache_timeout is None else cache_timeout
+    if immutable:
+        response.cache_control['immutable'] = None
+    return response
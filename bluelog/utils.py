@@ -10,7 +10,12 @@ try:
 except ImportError:
     from urllib.parse import urlparse, urljoin
 
+import re
+from html import escape
+from html.parser import HTMLParser
+
 from flask import request, redirect, url_for, current_app
+from markupsafe import Markup
 
 
 def is_safe_url(target):
@@ -31,3 +36,100 @@ def redirect_back(default='blog.index', **kwargs):
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in current_app.config['BLUELOG_ALLOWED_IMAGE_EXTENSIONS']
+
+
+class _HTMLCleaner(HTMLParser):
+    allowed_tags = {
+        'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'code', 'del', 'div', 'em', 'figcaption', 'figure',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'li', 'ol', 'p', 'pre', 's', 'small', 'span',
+        'strike', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul'
+    }
+    allowed_attrs = {
+        '*': {'class', 'style', 'title'},
+        'a': {'href', 'name', 'target', 'rel'},
+        'img': {'src', 'alt', 'width', 'height'},
+        'td': {'colspan', 'rowspan'},
+        'th': {'colspan', 'rowspan'},
+    }
+    void_tags = {'br', 'hr', 'img'}
+    dropped_tags = {'script', 'style', 'iframe', 'object'}  # including what's inside
+    allowed_schemes = {'', 'http', 'https', 'mailto'}
+
+    def __init__(self):
+        super(_HTMLCleaner, self).__init__(convert_charrefs=True)
+        self.parts = []
+        self.dropping = 0
+
+    def _clean_attr(self, tag, name, value):
+        if name not in self.allowed_attrs['*'] and name not in self.allowed_attrs.get(tag, ()):
+            return None
+        value = value or ''
+        if name in ('href', 'src') and urlparse(value.strip()).scheme.lower() not in self.allowed_schemes:
+            return None
+        if name == 'style' and ('expression' in value.lower() or 'url(' in value.lower()):
+            return None
+        return ' %s="%s"' % (name, escape(value))
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.dropped_tags:
+            self.dropping += tag not in self.void_tags
+        elif not self.dropping and tag in self.allowed_tags:
+            attrs = [self._clean_attr(tag, name, value) for name, value in attrs]
+            self.parts.append('<%s%s>' % (tag, ''.join(attr for attr in attrs if attr)))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in self.void_tags:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.dropped_tags:
+            self.dropping = max(self.dropping - 1, 0)
+        elif not self.dropping and tag in self.allowed_tags and tag not in self.void_tags:
+            self.parts.append('</%s>' % tag)
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data, quote=False))
+
+
+def clean_html(html):
+    """Keep the harmless tags and attributes of an HTML fragment only."""
+    cleaner = _HTMLCleaner()
+    cleaner.feed(html or '')
+    cleaner.close()
+    return ''.join(cleaner.parts)
+
+
+# the resized copies of the uploaded images, see bluelog.images
+IMAGE_VARIANTS = (('thumb', 200), ('medium', 800), ('large', 1600))
+upload_img_re = re.compile(r'<img([^>]*?) src="(/[^"]*?/uploads/)((?!variants/)[^"]+\.(?:jpe?g|png))"([^>]*)>',
+                           re.IGNORECASE)
+
+
+def variant_url(uploads_url, filename, variant, extension):
+    return '%svariants/%s/%s.%s' % (uploads_url, filename, variant, extension)
+
+
+def responsive_images(html):
+    """Point the images uploaded to the blog at their resized and WebP variants."""
+    def replace(match):
+        before, uploads_url, filename, after = match.groups()
+        extension = filename.rsplit('.', 1)[1]
+
+        def srcset(extension):
+            return ', '.join('%s %dw' % (variant_url(uploads_url, filename, variant, extension), width)
+                             for variant, width in IMAGE_VARIANTS[1:])
+        return '<picture><source type="image/webp" srcset="%s" sizes="(max-width: 800px) 100vw, 800px">' \
+               '<img%s src="%s" srcset="%s" sizes="(max-width: 800px) 100vw, 800px"%s></picture>' % (
+                   srcset('webp'), before, variant_url(uploads_url, filename, 'large', extension),
+                   srcset(extension), after)
+    return upload_img_re.sub(replace, html)
+
+
+def make_excerpt(html, length=255, end='...'):
+    """Plain text beginning of an HTML fragment, cut at a word boundary."""
+    text = Markup(html or '').striptags()
+    if len(text) <= length:
+        return text
+    return text[:length - len(end)].rsplit(' ', 1)[0] + end
@@ -0,0 +1,40 @@
+"""Add comment_day table and an index on post comment_count
+
+Revision ID: 1d6c8b4e2f95
+Revises: f3b7a1c9e584
+Create Date: 2026-10-17 18:02:37.918000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d6c8b4e2f95'
+down_revision = 'f3b7a1c9e584'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    comment_day = op.create_table('comment_day',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('comment_count', sa.Integer(), nullable=True),
+    sa.Column('unread_count', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_index(op.f('ix_post_comment_count'), 'post', ['comment_count'], unique=False)
+
+    comment = sa.table('comment', sa.column('id', sa.Integer), sa.column('timestamp', sa.DateTime),
+                       sa.column('reviewed', sa.Boolean))
+    day = sa.func.date(comment.c.timestamp, type_=sa.Date)
+    unread = sa.func.sum(sa.case([(comment.c.reviewed.is_(False), 1)], else_=0))
+    counts = op.get_bind().execute(sa.select([day, sa.func.count(comment.c.id), unread])
+                                   .where(comment.c.timestamp.isnot(None)).group_by(day))
+    op.bulk_insert(comment_day, [dict(day=day, comment_count=count, unread_count=unread)
+                                 for day, count, unread in counts])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_post_comment_count'), table_name='post')
+    op.drop_table('comment_day')
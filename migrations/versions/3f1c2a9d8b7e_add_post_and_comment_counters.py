@@ -0,0 +1,38 @@
+"""Add post and comment counters
+
+Revision ID: 3f1c2a9d8b7e
+Revises: babdd3ec9106
+Create Date: 2026-10-17 09:12:40.218000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b7e'
+down_revision = 'babdd3ec9106'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('category', sa.Column('post_count', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), nullable=True, server_default='0'))
+    category = sa.table('category', sa.column('id', sa.Integer), sa.column('post_count', sa.Integer))
+    post = sa.table('post', sa.column('id', sa.Integer), sa.column('category_id', sa.Integer),
+                    sa.column('comment_count', sa.Integer))
+    comment = sa.table('comment', sa.column('id', sa.Integer), sa.column('post_id', sa.Integer),
+                       sa.column('reviewed', sa.Boolean))
+    op.execute(category.update().values(post_count=sa.select([sa.func.count(post.c.id)])
+                                        .where(post.c.category_id == category.c.id).as_scalar()))
+    op.execute(post.update().values(comment_count=sa.select([sa.func.count(comment.c.id)])
+                                    .where(sa.and_(comment.c.post_id == post.c.id, comment.c.reviewed == sa.true()))
+                                    .as_scalar()))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('comment_count')
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.drop_column('post_count')
@@ -0,0 +1,31 @@
+"""Add composite indexes for the post and comment listings
+
+Revision ID: 5b8d3e7f1c24
+Revises: d27a9e5c4b13
+Create Date: 2026-10-17 14:05:31.417000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8d3e7f1c24'
+down_revision = 'd27a9e5c4b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_post_category_id_timestamp', 'post', ['category_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_comment_post_id_reviewed_timestamp', 'comment', ['post_id', 'reviewed', 'timestamp', 'id'],
+                    unique=False)
+    op.create_index('ix_comment_reviewed_timestamp', 'comment', ['reviewed', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_comment_from_admin_timestamp', 'comment', ['from_admin', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_from_admin_timestamp', table_name='comment')
+    op.drop_index('ix_comment_reviewed_timestamp', table_name='comment')
+    op.drop_index('ix_comment_post_id_reviewed_timestamp', table_name='comment')
+    op.drop_index('ix_post_category_id_timestamp', table_name='post')
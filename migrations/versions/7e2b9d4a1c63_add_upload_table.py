@@ -0,0 +1,37 @@
+"""Add upload table
+
+Revision ID: 7e2b9d4a1c63
+Revises: 1d6c8b4e2f95
+Create Date: 2026-10-17 19:24:51.302000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2b9d4a1c63'
+down_revision = '1d6c8b4e2f95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=True),
+    sa.Column('filename', sa.String(length=80), nullable=True),
+    sa.Column('original_name', sa.String(length=255), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_upload_digest'), 'upload', ['digest'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upload_digest'), table_name='upload')
+    op.drop_table('upload')
@@ -0,0 +1,28 @@
+"""Add post excerpt and rendered body
+
+Revision ID: 8c4e6f2b1a90
+Revises: 3f1c2a9d8b7e
+Create Date: 2026-10-17 10:03:11.472000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e6f2b1a90'
+down_revision = '3f1c2a9d8b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # run `flask backfill` afterwards to render the existing posts
+    op.add_column('post', sa.Column('body_html', sa.Text(), nullable=True))
+    op.add_column('post', sa.Column('excerpt', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('body_html')
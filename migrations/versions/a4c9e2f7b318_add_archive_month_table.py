@@ -0,0 +1,36 @@
+"""Add archive_month table
+
+Revision ID: a4c9e2f7b318
+Revises: e61f4a9c2d37
+Create Date: 2026-10-17 16:10:44.730000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e2f7b318'
+down_revision = 'e61f4a9c2d37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    archive_month = op.create_table('archive_month',
+    sa.Column('year', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('month', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('post_count', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('year', 'month')
+    )
+
+    post = sa.table('post', sa.column('id', sa.Integer), sa.column('timestamp', sa.DateTime))
+    year, month = sa.extract('year', post.c.timestamp), sa.extract('month', post.c.timestamp)
+    counts = op.get_bind().execute(sa.select([year, month, sa.func.count(post.c.id)])
+                                   .where(post.c.timestamp.isnot(None)).group_by(year, month))
+    op.bulk_insert(archive_month, [dict(year=int(year), month=int(month), post_count=post_count)
+                                   for year, month, post_count in counts])
+
+
+def downgrade():
+    op.drop_table('archive_month')
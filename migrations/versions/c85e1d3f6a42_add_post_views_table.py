@@ -0,0 +1,31 @@
+"""Add post_views table
+
+Revision ID: c85e1d3f6a42
+Revises: a4c9e2f7b318
+Create Date: 2026-10-17 16:48:21.305000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c85e1d3f6a42'
+down_revision = 'a4c9e2f7b318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_views',
+    sa.Column('post_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('views', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('post_id')
+    )
+    op.create_index(op.f('ix_post_views_views'), 'post_views', ['views'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_post_views_views'), table_name='post_views')
+    op.drop_table('post_views')
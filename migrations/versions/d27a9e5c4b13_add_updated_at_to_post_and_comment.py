@@ -0,0 +1,32 @@
+"""Add updated_at to post and comment
+
+Revision ID: d27a9e5c4b13
+Revises: 8c4e6f2b1a90
+Create Date: 2026-10-17 10:48:52.905000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27a9e5c4b13'
+down_revision = '8c4e6f2b1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_post_updated_at'), 'post', ['updated_at'], unique=False)
+    op.add_column('comment', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE post SET updated_at = timestamp')
+    op.execute('UPDATE comment SET updated_at = timestamp')
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_column('updated_at')
+    op.drop_index(op.f('ix_post_updated_at'), table_name='post')
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('updated_at')
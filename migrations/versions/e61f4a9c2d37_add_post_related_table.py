@@ -0,0 +1,35 @@
+"""Add post_related table
+
+Revision ID: e61f4a9c2d37
+Revises: 5b8d3e7f1c24
+Create Date: 2026-10-17 15:22:08.164000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61f4a9c2d37'
+down_revision = '5b8d3e7f1c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_related',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('related_id', sa.Integer(), nullable=True),
+    sa.Column('score', sa.Float(), nullable=True),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['related_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('post_id', 'rank')
+    )
+    op.create_index(op.f('ix_post_related_related_id'), 'post_related', ['related_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_post_related_related_id'), table_name='post_related')
+    op.drop_table('post_related')
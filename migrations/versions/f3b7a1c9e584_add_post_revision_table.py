@@ -0,0 +1,36 @@
+"""Add post_revision table
+
+Revision ID: f3b7a1c9e584
+Revises: c85e1d3f6a42
+Create Date: 2026-10-17 17:26:53.412000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7a1c9e584'
+down_revision = 'c85e1d3f6a42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_revision',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=True),
+    sa.Column('number', sa.Integer(), nullable=True),
+    sa.Column('title', sa.String(length=60), nullable=True),
+    sa.Column('snapshot', sa.Boolean(), nullable=True),
+    sa.Column('data', sa.LargeBinary(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_post_revision_post_id_number', 'post_revision', ['post_id', 'number'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_post_revision_post_id_number', table_name='post_revision')
+    op.drop_table('post_revision')
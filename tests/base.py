@@ -10,7 +10,7 @@ import unittest
 from flask import url_for
 
 from bluelog import create_app
-from bluelog.extensions import db
+from bluelog.extensions import db, view_counter
 from bluelog.models import Admin
 
 
@@ -30,6 +30,7 @@ class BaseTestCase(unittest.TestCase):
         db.session.commit()
 
     def tearDown(self):
+        view_counter.flush()
         db.drop_all()
         self.context.pop()
 
@@ -5,10 +5,23 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import url_for
-
-from bluelog.models import Post, Category, Link, Comment
-from bluelog.extensions import db
+import hashlib
+import io
+import os
+import shutil
+from datetime import datetime
+
+from PIL import Image
+from flask import url_for, current_app, Flask
+from flask_sqlalchemy import get_debug_queries
+from sqlalchemy import event
+
+from bluelog.models import Post, Category, Link, Comment, ArchiveMonth, PostRevision, CommentDay, Upload, \
+    PostRelated, PostView
+from bluelog.extensions import db, search_index, category_cache
+from bluelog.related import update_related_posts
+from bluelog.stats import refresh_stats
+from bluelog.uploads import init_uploads
 
 from tests.base import BaseTestCase
 
@@ -25,6 +38,7 @@ class AdminTestCase(BaseTestCase):
         link = Link(name='GitHub', url='https://github.com/greyli')
         db.session.add_all([category, post, comment, link])
         db.session.commit()
+        category_cache.invalidate()  # the sidebar of the login page loaded the categories
 
     def test_new_post(self):
         response = self.client.get(url_for('admin.new_post'))
@@ -40,6 +54,37 @@ class AdminTestCase(BaseTestCase):
         self.assertIn('Post created.', data)
         self.assertIn('Something', data)
         self.assertIn('Hello, world.', data)
+        self.assertEqual(search_index.search('world')[0], 1)
+
+    def test_post_excerpt(self):
+        self.client.post(url_for('admin.new_post'), data=dict(
+            title='Something',
+            category=1,
+            body='<p>Hello, <em>world</em>.</p><script>alert("hacked")</script>'
+        ))
+        post = Post.query.get(2)
+        self.assertEqual(post.excerpt, 'Hello, world.')
+        self.assertEqual(post.body_html, '<p>Hello, <em>world</em>.</p>')
+
+        response = self.client.get(url_for('blog.show_post', post_id=2))
+        data = response.get_data(as_text=True)
+        self.assertIn('<p>Hello, <em>world</em>.</p>', data)
+        self.assertNotIn('hacked', data)
+
+    def test_new_post_same_month_race(self):
+        session = db.session()
+        now = datetime.utcnow()
+
+        def insert_meanwhile(update_context):
+            # another request counted its post of the month between our update and insert
+            session.execute(ArchiveMonth.__table__.insert(), dict(year=now.year, month=now.month, post_count=1))
+        event.listen(session, 'after_bulk_update', insert_meanwhile, once=True)
+        self.addCleanup(event.remove, session, 'after_bulk_update', insert_meanwhile)
+
+        response = self.client.post(url_for('admin.new_post'), data=dict(
+            title='Something', category=1, body='Hello, world.'), follow_redirects=True)
+        self.assertIn('Post created.', response.get_data(as_text=True))
+        self.assertEqual(ArchiveMonth.query.filter_by(year=now.year, month=now.month).one().post_count, 2)
 
     def test_edit_post(self):
         response = self.client.get(url_for('admin.edit_post', post_id=1))
@@ -57,6 +102,7 @@ class AdminTestCase(BaseTestCase):
         self.assertIn('Post updated.', data)
         self.assertIn('New post body.', data)
         self.assertNotIn('Blah...', data)
+        self.assertEqual(search_index.search('edited')[1][0].post_id, 1)
 
     def test_delete_post(self):
         response = self.client.get(url_for('admin.delete_post', post_id=1), follow_redirects=True)
@@ -64,9 +110,26 @@ class AdminTestCase(BaseTestCase):
         self.assertNotIn('Post deleted.', data)
         self.assertIn('405 Method Not Allowed', data)
 
+        search_index.add(Post.query.get(1))
         response = self.client.post(url_for('admin.delete_post', post_id=1), follow_redirects=True)
         data = response.get_data(as_text=True)
         self.assertIn('Post deleted.', data)
+        self.assertEqual(search_index.search('Hello')[0], 0)
+
+    def test_delete_related_post(self):
+        category = Category.query.get(1)
+        db.session.add_all([Post(title='Python', body='Flask web framework', category=category),
+                            Post(title='Tutorial', body='Flask web tutorial', category=category),
+                            Post(title='Cooking', body='Pasta with tomato sauce', category=category)])
+        db.session.commit()
+        update_related_posts(5, full=True)
+        self.assertEqual([post.id for post in Post.query.get(2).related_posts()], [3])
+
+        self.client.post(url_for('admin.delete_post', post_id=3))
+        self.assertEqual(PostRelated.query.filter_by(post_id=2).one().related_id, None)
+        # the post which listed it is computed again
+        self.assertEqual(update_related_posts(5), 1)
+        self.assertEqual(PostRelated.query.filter_by(post_id=2).count(), 0)
 
     def test_delete_comment(self):
         response = self.client.get(url_for('admin.delete_comment', comment_id=1), follow_redirects=True)
@@ -79,6 +142,209 @@ class AdminTestCase(BaseTestCase):
         self.assertIn('Comment deleted.', data)
         self.assertNotIn('A comment', data)
 
+    def test_post_revisions(self):
+        paragraphs = ['<p>Paragraph %d %s</p>' % (i, 'blah ' * 40) for i in range(100)]
+        bodies = []
+        for i in range(25):
+            paragraphs[i * 3] = '<p>Edit %d</p>' % i
+            bodies.append('\n'.join(paragraphs))
+            self.client.post(url_for('admin.edit_post', post_id=1), data=dict(title='Hello', category=1,
+                                                                              body=bodies[-1]))
+        self.client.post(url_for('admin.edit_post', post_id=1), data=dict(title='Hello', category=1,
+                                                                          body=bodies[-1]))
+
+        # the original body, then one revision per change
+        revisions = PostRevision.query.filter_by(post_id=1).order_by(PostRevision.number).all()
+        self.assertEqual(len(revisions), 26)
+        self.assertEqual(revisions[0].load_body(), 'Blah...')
+        self.assertEqual([revision.load_body() for revision in revisions[1:]], bodies)
+        self.assertEqual([revision.number for revision in revisions if revision.snapshot], [1, 21])
+        deltas = [revision.size for revision in revisions if not revision.snapshot]
+        self.assertLess(max(deltas), len(bodies[-1]) / 20)
+
+        response = self.client.get(url_for('admin.show_revision', post_id=1, number=3))
+        data = response.get_data(as_text=True)
+        self.assertIn('<div class="diff-delete">-&lt;p&gt;Paragraph 3 ', data)
+        self.assertIn('<div class="diff-insert">+&lt;p&gt;Edit 1&lt;/p&gt;</div>', data)
+        response = self.client.get(url_for('admin.post_revisions', post_id=1))
+        self.assertIn('#26', response.get_data(as_text=True))
+
+        self.client.post(url_for('admin.edit_post', post_id=1), data=dict(title='Renamed', category=1,
+                                                                          body=bodies[-1]))
+        db.session.add(PostView(post_id=1, views=5))
+        db.session.commit()
+        self.assertIn('Renamed', self.client.get(url_for('blog.index')).get_data(as_text=True))
+
+        response = self.client.post(url_for('admin.restore_revision', post_id=1, number=1), follow_redirects=True)
+        self.assertIn('Revision 1 restored.', response.get_data(as_text=True))
+        self.assertEqual(Post.query.get(1).body, 'Blah...')
+        self.assertEqual(PostRevision.query.filter_by(post_id=1, number=28).one().load_body(), 'Blah...')
+        # the popular posts of the sidebar
+        self.assertNotIn('Renamed', self.client.get(url_for('blog.index')).get_data(as_text=True))
+
+        self.client.post(url_for('admin.delete_post', post_id=1))
+        self.assertEqual(PostRevision.query.count(), 0)
+
+    def test_dashboard(self):
+        refresh_stats()
+        self.logout()
+        for i in range(3):
+            self.client.post(url_for('blog.show_post', post_id=1), data=dict(
+                author='Guest', email='a@b.com', body='Guest comment %d' % i))
+        self.login()
+        self.client.post(url_for('blog.show_post', post_id=1), data=dict(body='Admin comment'))
+        self.client.post(url_for('admin.approve_comment', comment_id=2))
+        self.client.post(url_for('admin.approve_comments'), data=dict(comment_id=[3]))
+        self.client.post(url_for('admin.delete_comment', comment_id=1))
+
+        stats = CommentDay.query.get(datetime.utcnow().date())
+        self.assertEqual((stats.comment_count, stats.unread_count), (4, 1))
+        counters = [(day.day, day.comment_count, day.unread_count) for day in CommentDay.query]
+        # the counters kept by the handlers are the ones computed from scratch
+        refresh_stats()
+        self.assertEqual([(day.day, day.comment_count, day.unread_count) for day in CommentDay.query], counters)
+        self.assertEqual(Post.query.get(1).comment_count, 3)
+
+        response = self.client.get(url_for('admin.dashboard'))
+        data = response.get_data(as_text=True)
+        self.assertIn('<h2>1</h2>', data)
+        self.assertIn('<td class="text-right">4</td>', data)
+        self.assertIn('<span class="badge badge-primary badge-pill">3</span>', data)
+
+        self.client.post(url_for('admin.delete_post', post_id=1))
+        self.assertEqual(CommentDay.query.get(datetime.utcnow().date()).comment_count, 0)
+
+    def test_upload_image(self):
+        upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+        self.addCleanup(shutil.rmtree, upload_path, True)
+        exif = Image.Exif()
+        exif[0x010f] = 'Phone'  # Make
+        exif[0x0112] = 6  # Orientation, rotated by 90 degrees
+        photo = io.BytesIO()
+        Image.new('RGB', (2400, 1200), 'red').save(photo, 'JPEG', exif=exif)
+        photo.seek(0)
+
+        digest = hashlib.sha256(photo.getvalue()).hexdigest()
+        stored = '%s/%s/%s.jpg' % (digest[:2], digest[2:4], digest)
+
+        response = self.client.post(url_for('admin.upload_image'), data=dict(upload=(photo, 'photo.jpg')))
+        self.assertEqual(response.get_json()['url'], '/admin/uploads/' + stored)
+        with Image.open(os.path.join(upload_path, stored)) as image:
+            self.assertEqual(image.size, (1200, 2400))
+            self.assertEqual(len(image.getexif()), 0)
+        for filename, size in (('thumb.jpg', (200, 400)), ('medium.webp', (800, 1600)), ('large.jpg', (1200, 2400))):
+            with Image.open(os.path.join(upload_path, 'variants', stored, filename)) as image:
+                self.assertEqual(image.size, size)
+                self.assertEqual(len(image.getexif()), 0)
+
+        response = self.client.get('/admin/uploads/variants/%s/medium.webp' % stored)
+        self.assertEqual(response.mimetype, 'image/webp')
+        # the original until the variants are written
+        with open(os.path.join(upload_path, 'pending.png'), 'wb') as f:
+            Image.new('RGB', (10, 10)).save(f, 'PNG')
+        response = self.client.get('/admin/uploads/variants/pending.png/large.webp')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(self.client.get('/admin/uploads/variants/missing.png/large.webp').status_code, 404)
+
+        self.client.post(url_for('admin.new_post'), data=dict(
+            title='Photo', category=1, body='<p><img alt="A photo" src="/admin/uploads/%s"></p>' % stored))
+        body_html = Post.query.get(2).body_html
+        self.assertIn('<source type="image/webp" srcset="/admin/uploads/variants/{0}/medium.webp 800w, '
+                      '/admin/uploads/variants/{0}/large.webp 1600w"'.format(stored), body_html)
+        self.assertIn('<img alt="A photo" src="/admin/uploads/variants/%s/large.jpg"' % stored, body_html)
+
+    def test_upload_same_image(self):
+        upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+        self.addCleanup(shutil.rmtree, upload_path, True)
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(image, 'PNG')
+        content = image.getvalue()
+
+        urls = [self.client.post(url_for('admin.upload_image'),
+                                 data=dict(upload=(io.BytesIO(content), name))).get_json()['url']
+                for name in ('first.png', 'second.png')]
+        self.assertEqual(urls[0], urls[1])
+        upload = Upload.query.one()
+        self.assertEqual(upload.original_name, 'first.png')
+        self.assertEqual((upload.size, upload.width, upload.height, upload.ref_count), (len(content), 300, 200, 2))
+        self.assertEqual(urls[0], '/admin/uploads/' + upload.filename)
+        self.assertEqual(sorted(os.listdir(upload_path)), [upload.digest[:2], 'variants'])
+
+        response = self.client.post(url_for('admin.upload_image'),
+                                    data=dict(upload=(io.BytesIO(b'Not an image'), 'fake.png')))
+        self.assertEqual(response.get_json()['error']['message'], 'Image only!')
+        self.assertEqual(Upload.query.count(), 1)
+        self.assertEqual(sorted(os.listdir(upload_path)), [upload.digest[:2], 'variants'])
+
+    def test_upload_truncated_image(self):
+        self.addCleanup(shutil.rmtree, current_app.config['BLUELOG_UPLOAD_PATH'], True)
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(image, 'PNG')
+
+        # the header is read, the rest is not
+        response = self.client.post(url_for('admin.upload_image'),
+                                    data=dict(upload=(io.BytesIO(image.getvalue()[:100]), 'truncated.png')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['url'], '/admin/uploads/' + Upload.query.one().filename)
+
+    def test_get_image_caching(self):
+        upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+        self.addCleanup(shutil.rmtree, upload_path, True)
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'green').save(image, 'PNG')
+        content = image.getvalue()
+        image.seek(0)
+        url = self.client.post(url_for('admin.upload_image'), data=dict(upload=(image, 'green.png'))).get_json()['url']
+
+        response = self.client.get(url)
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        response = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, headers={'Range': 'bytes=0-7'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'\x89PNG\r\n\x1a\n')
+        response = self.client.get(url.replace('/uploads/', '/uploads/variants/') + '/thumb.webp')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        # the flat uploads may be overwritten
+        with open(os.path.join(upload_path, 'flat.png'), 'wb') as f:
+            f.write(content)
+        response = self.client.get('/admin/uploads/flat.png')
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_upload_sendfile_setting(self):
+        app = Flask(__name__)
+        app.config['BLUELOG_UPLOAD_SENDFILE'] = ''
+        init_uploads(app)
+        self.assertIsNone(app.config['BLUELOG_UPLOAD_SENDFILE'])
+        app.config['BLUELOG_UPLOAD_SENDFILE'] = 'nginx'
+        with self.assertRaises(ValueError):
+            init_uploads(app)
+
+    def test_get_image_sendfile(self):
+        upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+        self.addCleanup(shutil.rmtree, upload_path, True)
+        self.addCleanup(current_app.config.__setitem__, 'BLUELOG_UPLOAD_SENDFILE', None)
+        os.makedirs(upload_path, exist_ok=True)
+        with open(os.path.join(upload_path, 'photo.png'), 'wb') as f:
+            Image.new('RGB', (10, 10)).save(f, 'PNG')
+
+        current_app.config['BLUELOG_UPLOAD_SENDFILE'] = 'x-accel-redirect'
+        response = self.client.get('/admin/uploads/photo.png')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-uploads/photo.png')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.data, b'')
+        response = self.client.get('/admin/uploads/variants/photo.png/large.webp')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-uploads/photo.png')
+        self.assertIn('max-age=0', response.headers['Cache-Control'])
+        self.assertEqual(self.client.get('/admin/uploads/missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/admin/uploads/../settings.py').status_code, 404)
+
+        current_app.config['BLUELOG_UPLOAD_SENDFILE'] = 'x-sendfile'
+        response = self.client.get('/admin/uploads/photo.png')
+        self.assertEqual(response.headers['X-Sendfile'], os.path.join(os.path.abspath(upload_path), 'photo.png'))
+
     def test_enable_comment(self):
         post = Post.query.get(1)
         post.can_comment = False
@@ -123,6 +389,104 @@ class AdminTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertIn('I am a guest comment.', data)
 
+    def test_comment_counter(self):
+        post = Post.query.get(1)
+        self.assertEqual(post.comment_count, 0)
+
+        self.client.post(url_for('admin.approve_comment', comment_id=1))
+        self.assertEqual(post.comment_count, 1)
+        self.client.post(url_for('admin.approve_comment', comment_id=1))
+        self.assertEqual(post.comment_count, 1)
+
+        self.client.post(url_for('blog.show_post', post_id=1) + '?reply=1', data=dict(body='A reply'))
+        self.assertEqual(post.comment_count, 2)
+
+        self.client.post(url_for('admin.delete_comment', comment_id=1))
+        self.assertEqual(post.comment_count, 0)
+
+    def test_bulk_approve_comments(self):
+        post = Post.query.get(1)
+        db.session.add_all([
+            Comment(body='Spam', email='spam@example.com', post=post, timestamp=datetime(2018, 1, 1)),
+            Comment(body='Spam', email='spam@example.com', post=post, timestamp=datetime(2018, 6, 1)),
+            Comment(body='Ham', email='ham@example.com', post=post, timestamp=datetime(2018, 1, 1)),
+        ])
+        db.session.commit()
+
+        response = self.client.post(url_for('admin.approve_comments'), follow_redirects=True)
+        self.assertIn('No comments selected.', response.get_data(as_text=True))
+        response = self.client.post(url_for('admin.approve_comments'), data=dict(before='yesterday'),
+                                    follow_redirects=True)
+        self.assertIn('Invalid date.', response.get_data(as_text=True))
+
+        response = self.client.post(url_for('admin.approve_comments'), data=dict(
+            unread='1', email='spam@example.com', before='2018-03-01'), follow_redirects=True)
+        self.assertIn('1 comments published.', response.get_data(as_text=True))
+        self.assertEqual(Post.query.get(1).comment_count, 1)
+
+        self.client.post(url_for('admin.approve_comments'), data=dict(comment_id=[1, 2, 4]))
+        self.assertEqual(Post.query.get(1).comment_count, 3)
+        self.assertEqual(Comment.query.filter_by(reviewed=False).count(), 1)
+
+    def test_bulk_delete_comments(self):
+        post = Post.query.get(1)
+        spam = Comment(body='Spam', email='spam@example.com', post=post, reviewed=True)
+        reply = Comment(body='Re: Spam', email='ham@example.com', post=post, reviewed=True, replied=spam)
+        nested = Comment(body='Re: Re: Spam', email='ham@example.com', post=post, replied=reply)
+        other = Comment(body='Ham', email='ham@example.com', post=post, reviewed=True)
+        post.comment_count = 3
+        db.session.add_all([spam, reply, nested, other])
+        db.session.commit()
+        other_id = other.id
+
+        response = self.client.post(url_for('admin.delete_comments'), data=dict(email='spam@example.com'),
+                                    follow_redirects=True)
+        self.assertIn('3 comments deleted.', response.get_data(as_text=True))
+        self.assertEqual(Post.query.get(1).comment_count, 1)
+        self.assertEqual(sorted(comment.body for comment in Comment.query), ['A comment', 'Ham'])
+
+        self.client.post(url_for('admin.delete_comments'), data=dict(comment_id=[1, other_id]))
+        self.assertEqual(Comment.query.count(), 0)
+        self.assertEqual(Post.query.get(1).comment_count, 0)
+
+    def test_bulk_delete_comments_replies_first(self):
+        db.session.execute('PRAGMA foreign_keys = ON')
+        post = Post.query.get(1)
+        root = Comment(body='Thread', post=post)
+        reply = Comment(body='Thread reply', post=post, replied=root)
+        db.session.add_all([root, reply, Comment(body='Thread reply', post=post, replied=reply)])
+        db.session.commit()
+
+        self.assertEqual(Comment.delete_all(Comment.id == root.id, batch_size=1), 3)
+        db.session.commit()
+        self.assertEqual(Comment.query.filter(Comment.body.startswith('Thread')).count(), 0)
+        db.session.execute('PRAGMA foreign_keys = OFF')
+
+    def test_post_counter(self):
+        self.client.post(url_for('admin.new_category'), data=dict(name='Tech'))
+        self.client.post(url_for('admin.new_post'), data=dict(title='Something', category=2, body='Hello'))
+        default = Category.query.get(1)
+        tech = Category.query.get(2)
+        self.assertEqual(tech.post_count, 1)
+        self.assertEqual(default.post_count, 0)
+
+        self.client.post(url_for('admin.edit_post', post_id=2), data=dict(title='Something', category=1, body='Hello'))
+        self.assertEqual(tech.post_count, 0)
+        self.assertEqual(default.post_count, 1)
+
+        self.client.post(url_for('admin.delete_post', post_id=2))
+        self.assertEqual(default.post_count, 0)
+
+    def test_archive_counter(self):
+        self.client.post(url_for('admin.new_post'), data=dict(title='Something', category=1, body='Hello'))
+        self.client.post(url_for('admin.new_post'), data=dict(title='Another', category=1, body='Hello'))
+        post = Post.query.get(2)
+        archive = ArchiveMonth.query.get((post.timestamp.year, post.timestamp.month))
+        self.assertEqual(archive.post_count, 2)
+
+        self.client.post(url_for('admin.delete_post', post_id=2))
+        self.assertEqual(archive.post_count, 1)
+
     def test_new_category(self):
         response = self.client.get(url_for('admin.new_category'))
         data = response.get_data(as_text=True)
@@ -145,6 +509,24 @@ class AdminTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertIn('Post Title', data)
 
+    def test_category_registry(self):
+        self.client.get(url_for('admin.new_post'))
+        queries = len(get_debug_queries())
+        data = self.client.get(url_for('admin.new_post')).get_data(as_text=True)
+        self.assertIn('<option selected value="1">Default</option>', data)
+        self.assertFalse([query for query in get_debug_queries()[queries:] if 'FROM category' in query.statement])
+
+        response = self.client.post(url_for('admin.new_post'), data=dict(title='Something', category=42, body='Hello'))
+        self.assertIn('Not a valid choice', response.get_data(as_text=True))
+
+        self.client.post(url_for('admin.new_category'), data=dict(name='Series'))
+        data = self.client.get(url_for('admin.new_post')).get_data(as_text=True)
+        self.assertIn('<option value="2">Series</option>', data)
+        response = self.client.post(url_for('admin.new_post'), data=dict(title='Something', category=2, body='Hello'),
+                                    follow_redirects=True)
+        self.assertIn('Post created.', response.get_data(as_text=True))
+        self.assertIn('<span class="badge badge-primary badge-pill"> 1</span>', response.get_data(as_text=True))
+
     def test_edit_category(self):
         response = self.client.post(url_for('admin.edit_category', category_id=1),
                                     data=dict(name='Default edited'), follow_redirects=True)
@@ -195,6 +577,25 @@ class AdminTestCase(BaseTestCase):
         self.assertIn('Default', data)
         self.assertNotIn('Tech', data)
 
+    def test_delete_category_moves_posts(self):
+        tech = Category(name='Tech', post_count=20)
+        db.session.add(tech)
+        db.session.add_all([Post(title='Post %d' % i, body='Blah...', category=tech) for i in range(20)])
+        db.session.commit()
+        Category.query.get(1).post_count = 1
+        db.session.commit()
+
+        queries = len(get_debug_queries())
+        self.client.post(url_for('admin.delete_category', category_id=2))
+        # one statement for all the posts
+        statements = [query.statement for query in get_debug_queries()[queries:]]
+        self.assertEqual(len([statement for statement in statements if statement.startswith('UPDATE post ')]), 1)
+        self.assertFalse([statement for statement in statements if statement.startswith('SELECT post.')])
+
+        self.assertIsNone(Category.query.get(2))
+        self.assertEqual(Category.query.get(1).post_count, 21)
+        self.assertEqual(Post.query.filter_by(category_id=1).count(), 21)
+
     def test_new_link(self):
         response = self.client.get(url_for('admin.new_link'))
         data = response.get_data(as_text=True)
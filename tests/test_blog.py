@@ -5,10 +5,15 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import url_for
+import re
+from datetime import datetime
 
-from bluelog.models import Post, Category, Link, Comment
-from bluelog.extensions import db
+from flask import url_for, current_app
+from flask_sqlalchemy import get_debug_queries
+from sqlalchemy import event
+
+from bluelog.models import Post, Category, Link, Comment, ArchiveMonth, PostView, CommentDay
+from bluelog.extensions import db, search_index, page_cache, context_cache, category_cache, view_counter
 
 from tests.base import BaseTestCase
 
@@ -26,6 +31,7 @@ class BlogTestCase(BaseTestCase):
 
         db.session.add_all([category, post, comment, link])
         db.session.commit()
+        category_cache.invalidate()  # the sidebar of the login page loaded the categories
 
     def test_index_page(self):
         response = self.client.get('/')
@@ -87,6 +93,24 @@ class BlogTestCase(BaseTestCase):
         self.assertIn('Thanks, your comment will be published after reviewed.', data)
         self.assertNotIn('I am a guest comment.', data)
 
+    def test_new_guest_comment_same_day_race(self):
+        self.logout()
+        session = db.session()
+
+        def insert_meanwhile(update_context):
+            # another request counted its comment of the day between our update and insert
+            session.execute(CommentDay.__table__.insert(), dict(day=datetime.utcnow().date(), comment_count=1,
+                                                                unread_count=1))
+        event.listen(session, 'after_bulk_update', insert_meanwhile, once=True)
+        self.addCleanup(event.remove, session, 'after_bulk_update', insert_meanwhile)
+
+        response = self.client.post(url_for('blog.show_post', post_id=1), data=dict(
+            author='Guest', email='a@b.com', body='I am a guest comment.'), follow_redirects=True)
+        self.assertIn('Thanks, your comment will be published after reviewed.', response.get_data(as_text=True))
+        self.assertEqual(Comment.query.filter_by(body='I am a guest comment.').count(), 1)
+        stats = CommentDay.query.one()
+        self.assertEqual((stats.comment_count, stats.unread_count), (2, 2))
+
     def test_reply_status(self):
         response = self.client.get(url_for('blog.reply_comment', comment_id=1), follow_redirects=True)
         data = response.get_data(as_text=True)
@@ -125,3 +149,349 @@ class BlogTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertIn('Thanks, your comment will be published after reviewed.', data)
         self.assertNotIn('I am a guest comment.', data)
+
+    def test_page_cache(self):
+        self.logout()
+        response = self.client.get(url_for('blog.index'))
+        self.assertIn('Hello Post', response.get_data(as_text=True))
+
+        post = Post.query.get(1)
+        post.title = 'Changed Post'
+        db.session.commit()
+        response = self.client.get(url_for('blog.index'))
+        data = response.get_data(as_text=True)
+        self.assertIn('Hello Post', data)
+        self.assertNotIn('Changed Post', data)
+
+        self.login()
+        self.client.post(url_for('admin.edit_post', post_id=1), data=dict(
+            title='Edited Post',
+            category=1,
+            body='Blah...'
+        ))
+        self.logout()
+        response = self.client.get(url_for('blog.index'))
+        data = response.get_data(as_text=True)
+        self.assertIn('Edited Post', data)
+        self.assertNotIn('Hello Post', data)
+
+    def test_page_cache_skips_admin(self):
+        self.client.get(url_for('blog.index'))
+        post = Post.query.get(1)
+        post.title = 'Changed Post'
+        db.session.commit()
+        response = self.client.get(url_for('blog.index'))
+        self.assertIn('Changed Post', response.get_data(as_text=True))
+
+    def test_keyset_pagination(self):
+        current_app.config['BLUELOG_KEYSET_PAGINATION'] = True
+        category = Category.query.get(1)
+        for i in range(15):
+            post = Post(title='Title-%02d' % i, category=category, body='Blah...', timestamp=datetime(2018, 1, i + 1))
+            db.session.add(post)
+        db.session.commit()
+
+        response = self.client.get(url_for('blog.index'))
+        data = response.get_data(as_text=True)
+        self.assertIn('Hello Post', data)
+        self.assertIn('Title-06', data)
+        self.assertNotIn('Title-05', data)
+
+        next_url = re.findall(r'href="([^"]*cursor=[^"]*)"', data)[-1]
+        response = self.client.get(next_url)
+        data = response.get_data(as_text=True)
+        self.assertIn('Title-05', data)
+        self.assertIn('Title-00', data)
+        self.assertNotIn('Title-06', data)
+
+        prev_url = re.findall(r'href="([^"]*cursor=[^"]*)"', data)[0]
+        response = self.client.get(prev_url)
+        data = response.get_data(as_text=True)
+        self.assertIn('Hello Post', data)
+        self.assertIn('Title-06', data)
+        self.assertNotIn('Title-05', data)
+
+        response = self.client.get(url_for('blog.index', cursor='bad-cursor'))
+        self.assertEqual(response.status_code, 404)
+        # no previous page before the first one
+        data = self.client.get(url_for('blog.index')).get_data(as_text=True)
+        first = re.findall(r'href="([^"]*cursor=[^"]*)"', data)
+        response = self.client.get(url_for('blog.index') + '?cursor=')
+        self.assertEqual(re.findall(r'href="([^"]*cursor=[^"]*)"', response.get_data(as_text=True)), first)
+
+    def test_cached_template_context(self):
+        self.logout()
+        self.client.get(url_for('blog.about'))
+        query_count = len(get_debug_queries())
+        response = self.client.get(url_for('blog.about'))
+        self.assertEqual(len(get_debug_queries()), query_count)
+        self.assertIn('GitHub', response.get_data(as_text=True))
+
+        self.login()
+        self.client.post(url_for('admin.edit_link', link_id=1), data=dict(
+            name='Gitee',
+            url='https://gitee.com'
+        ))
+        self.logout()
+        response = self.client.get(url_for('blog.about'))
+        data = response.get_data(as_text=True)
+        self.assertIn('href="https://gitee.com"', data)
+        self.assertNotIn('href="https://github.com/greyli"', data)
+
+    def count_queries(self, url):
+        db.session.expunge_all()
+        query_count = len(get_debug_queries())
+        self.client.get(url)
+        return len(get_debug_queries()) - query_count
+
+    def test_index_query_count(self):
+        def add_posts():
+            for i in range(current_app.config['BLUELOG_POST_PER_PAGE']):
+                category = Category(name='Category %d' % Category.query.count())
+                post = Post(title='Post', category=category, body='Blah...')
+                comment = Comment(body='A comment', post=post, reviewed=True)
+                db.session.add_all([category, post, comment])
+            db.session.commit()
+
+        add_posts()
+        self.client.get(url_for('blog.index'))  # fill the template context cache
+        query_count = self.count_queries(url_for('blog.index'))
+        add_posts()
+        self.assertEqual(self.count_queries(url_for('blog.index')), query_count)
+        self.assertEqual(self.count_queries(url_for('admin.manage_post')), query_count)
+
+    def test_post_query_count(self):
+        def add_comments():
+            post = Post.query.get(1)
+            other_post = Post(title='Other Post', category=post.category, body='Blah...')
+            for i in range(current_app.config['BLUELOG_COMMENT_PER_PAGE']):
+                replied = Comment(body='A comment', post=other_post, reviewed=True)
+                reply = Comment(body='A reply', post=post, reviewed=True, replied=replied)
+                db.session.add_all([replied, reply])
+            db.session.commit()
+
+        add_comments()
+        self.client.get(url_for('blog.show_post', post_id=1, page=2))
+        query_count = self.count_queries(url_for('blog.show_post', post_id=1, page=2))
+        add_comments()
+        self.assertEqual(self.count_queries(url_for('blog.show_post', post_id=1, page=2)), query_count)
+
+    def test_conditional_get(self):
+        self.logout()
+        for url in url_for('blog.index'), url_for('blog.show_category', category_id=1), \
+                url_for('blog.show_post', post_id=1):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            last_modified = response.headers['Last-Modified']
+
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b'')
+
+            response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304)
+
+        etag = self.client.get(url_for('blog.show_post', post_id=1)).headers['ETag']
+        post = Post.query.get(1)
+        post.title = 'Changed Post'
+        db.session.commit()
+        response = self.client.get(url_for('blog.show_post', post_id=1), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_search(self):
+        db.session.add_all([
+            Post(title='Quick fox', body='<p>The quick brown fox jumps.</p>', category_id=1),
+            Post(title='Slow <turtle>', body='<p>A brown dog is quick to sleep.</p>', category_id=1),
+        ])
+        db.session.commit()
+        search_index.rebuild(Post.query)
+        self.logout()
+
+        response = self.client.get(url_for('blog.search', q='quick'))
+        data = response.get_data(as_text=True)
+        self.assertIn('2 posts', data)
+        # the title match ranks first
+        self.assertLess(data.index('<mark>Quick</mark> fox'), data.index('Slow &lt;turtle&gt;'))
+        self.assertIn('The <mark>quick</mark> brown fox jumps.', data)
+
+        response = self.client.get(url_for('blog.search', q='"brown fox"'))
+        data = response.get_data(as_text=True)
+        self.assertIn('1 posts', data)
+        self.assertIn('<mark>brown fox</mark>', data)
+
+        for q in ('nothing', 'quick AND (', ''):
+            response = self.client.get(url_for('blog.search', q=q))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('No posts found.', response.get_data(as_text=True))
+
+    def test_feeds(self):
+        self.logout()
+        post = Post.query.get(1)
+        post.body = '<p>Hello <b>feed</b> & readers.</p>'
+        db.session.commit()
+        for url in url_for('blog.feed', feed_type='atom'), url_for('blog.feed', feed_type='atom', category_id=1):
+            response = self.client.get(url)
+            self.assertEqual(response.mimetype, 'application/atom+xml')
+            data = response.get_data(as_text=True)
+            self.assertIn('<title>Hello Post</title>', data)
+            self.assertIn('<summary>Hello feed &amp; readers.</summary>', data)
+            self.assertIn('<category term="Default"/>', data)
+            response = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url_for('blog.feed', feed_type='rss'))
+        self.assertEqual(response.mimetype, 'application/rss+xml')
+        self.assertIn('<description>Hello feed &amp; readers.</description>', response.get_data(as_text=True))
+
+        current_app.config['BLUELOG_FEED_FULL_BODY'] = True
+        page_cache.invalidate()
+        data = self.client.get(url_for('blog.feed', feed_type='atom')).get_data(as_text=True)
+        self.assertIn('<content type="html">&lt;p&gt;Hello &lt;b&gt;feed&lt;/b&gt; &amp;amp; readers.&lt;/p&gt;'
+                      '</content>', data)
+
+        self.assertEqual(self.client.get(url_for('blog.feed', feed_type='atom', category_id=2)).status_code, 404)
+        self.assertEqual(self.client.get('/feed/json').status_code, 404)
+
+    def test_feed_query_count(self):
+        for i in range(5):
+            db.session.add(Post(title='Post', body='Blah...', category=Category(name='Category %d' % i)))
+        db.session.commit()
+        self.logout()
+        current_app.config['BLUELOG_PAGE_CACHE'] = False
+        self.client.get(url_for('blog.feed', feed_type='atom'))  # fill the template context cache
+        # the conditional GET validators and the posts with their categories
+        self.assertEqual(self.count_queries(url_for('blog.feed', feed_type='atom')), 3)
+
+    def test_sitemap(self):
+        self.logout()
+        response = self.client.get(url_for('blog.sitemap'))
+        self.assertEqual(response.mimetype, 'application/xml')
+        data = response.get_data(as_text=True)
+        self.assertIn('<urlset', data)
+        self.assertIn('<loc>http://localhost/</loc>', data)
+        self.assertIn('<loc>http://localhost/category/1</loc>', data)
+        self.assertIn('<loc>http://localhost/post/1</loc><lastmod>', data)
+        response = self.client.get(url_for('blog.sitemap'), headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        # each host keeps its own file
+        etag = response.headers['ETag']
+        data = self.client.get(url_for('blog.sitemap'), base_url='https://www.example.com').get_data(as_text=True)
+        self.assertIn('<loc>https://www.example.com/</loc>', data)
+        self.assertEqual(self.client.get(url_for('blog.sitemap')).headers['ETag'], etag)
+
+        current_app.config['BLUELOG_SITEMAP_SHARD_SIZE'] = 2
+        db.session.add_all([Post(title='Post %d' % i, body='Blah...', category_id=1) for i in range(3)])
+        db.session.commit()
+        data = self.client.get(url_for('blog.sitemap')).get_data(as_text=True)
+        self.assertIn('<sitemapindex', data)
+        self.assertIn('<loc>http://localhost/sitemap-pages.xml</loc>', data)
+        self.assertIn('<loc>http://localhost/sitemap-posts-1.xml</loc>', data)
+        self.assertIn('<loc>http://localhost/sitemap-posts-2.xml</loc>', data)
+        self.assertNotIn('sitemap-posts-3.xml', data)
+
+        data = self.client.get(url_for('blog.sitemap_pages')).get_data(as_text=True)
+        self.assertIn('<loc>http://localhost/about</loc>', data)
+        self.assertNotIn('/post/', data)
+        data = self.client.get(url_for('blog.sitemap_posts', shard=2)).get_data(as_text=True)
+        self.assertIn('<loc>http://localhost/post/3</loc>', data)
+        self.assertIn('<loc>http://localhost/post/4</loc>', data)
+        self.assertNotIn('<loc>http://localhost/post/1</loc>', data)
+        self.assertEqual(self.client.get(url_for('blog.sitemap_posts', shard=3)).status_code, 404)
+
+        # only the shard of the changed post is written again
+        first_etag = self.client.get(url_for('blog.sitemap_posts', shard=1)).headers['ETag']
+        second_etag = self.client.get(url_for('blog.sitemap_posts', shard=2)).headers['ETag']
+        post = Post.query.get(4)
+        post.title = 'Changed'
+        db.session.commit()
+        self.assertEqual(self.client.get(url_for('blog.sitemap_posts', shard=1)).headers['ETag'], first_etag)
+        self.assertNotEqual(self.client.get(url_for('blog.sitemap_posts', shard=2)).headers['ETag'], second_etag)
+
+    def test_comment_tree(self):
+        post = Post.query.get(1)
+        root = Comment.query.get(1)
+        reply = Comment(body='First reply', post=post, reviewed=True, replied=root)
+        nested = Comment(body='Nested reply', post=post, reviewed=True, replied=reply)
+        hidden = Comment(body='Hidden reply', post=post, reviewed=False, replied=root)
+        orphan = Comment(body='Reply to hidden', post=post, reviewed=True, replied=hidden)
+        db.session.add_all([reply, nested, hidden, orphan])
+        db.session.commit()
+
+        tree = Comment.load_tree(post)
+        self.assertEqual([node.comment.body for node in tree], ['A comment', 'Reply to hidden'])
+        self.assertEqual([node.comment.body for node in tree[0].replies], ['First reply'])
+        self.assertEqual([node.comment.body for node in tree[0].replies[0].replies], ['Nested reply'])
+        self.assertEqual(Comment.load_tree(post, []), [])
+
+        data = self.client.get(url_for('blog.show_post', post_id=1)).get_data(as_text=True)
+        self.assertNotIn('Hidden reply</p>', data)
+        self.assertLess(data.index('A comment'), data.index('First reply'))
+        self.assertLess(data.index('First reply'), data.index('Nested reply'))
+        self.assertEqual(data.count('comment-replies'), 2)
+        # the replied comment is quoted when it is not shown above
+        self.assertIn('<br>Hidden reply', data)
+
+    def test_comment_tree_query_count(self):
+        def add_replies(count):
+            parent = Comment.query.order_by(Comment.id.desc()).first()
+            for i in range(count):
+                parent = Comment(body='Reply %d' % i, post_id=1, reviewed=True, replied=parent)
+                db.session.add(parent)
+            db.session.commit()
+
+        add_replies(5)
+        self.client.get(url_for('blog.show_post', post_id=1))
+        query_count = self.count_queries(url_for('blog.show_post', post_id=1))
+        add_replies(20)
+        self.assertEqual(self.count_queries(url_for('blog.show_post', post_id=1)), query_count)
+
+    def test_archive(self):
+        db.session.add_all([
+            Post(title='Old Post', body='Blah...', category_id=1, timestamp=datetime(2017, 12, 31, 23, 59)),
+            Post(title='New Year Post', body='Blah...', category_id=1, timestamp=datetime(2018, 1, 1)),
+        ])
+        db.session.commit()
+        ArchiveMonth.update_post_counts()
+        db.session.commit()
+        context_cache.invalidate()
+        self.logout()
+
+        data = self.client.get(url_for('blog.archive')).get_data(as_text=True)
+        self.assertIn('2017-12', data)
+        self.assertIn('2018-01', data)
+        self.assertLess(data.index('2018-01'), data.index('2017-12'))
+        self.assertIn('href="/archive/2018/1"', data)
+
+        data = self.client.get(url_for('blog.show_archive', year=2017, month=12)).get_data(as_text=True)
+        self.assertIn('Old Post', data)
+        self.assertNotIn('New Year Post', data)
+        self.assertIn('1 posts', data)
+        data = self.client.get(url_for('blog.show_archive', year=2018, month=1)).get_data(as_text=True)
+        self.assertIn('New Year Post', data)
+        self.assertNotIn('Old Post', data)
+        self.assertEqual(self.client.get(url_for('blog.show_archive', year=2018, month=13)).status_code, 404)
+
+    def test_post_views(self):
+        for _ in range(3):
+            self.client.get(url_for('blog.show_post', post_id=1))
+        self.client.get(url_for('blog.show_post', post_id=99))
+        view_counter.hit(99)  # no such post
+        self.assertIsNone(PostView.query.get(1))
+        view_counter.flush()
+        self.assertEqual(PostView.query.get(1).views, 3)
+        self.assertIsNone(PostView.query.get(99))
+
+        view_counter.threshold = 2
+        self.client.get(url_for('blog.show_post', post_id=1))
+        self.assertEqual(PostView.query.get(1).views, 3)
+        self.client.get(url_for('blog.show_post', post_id=1))
+        db.session.expire_all()
+        self.assertEqual(PostView.query.get(1).views, 5)
+        self.assertEqual(view_counter.flush(), 0)
+
+        self.logout()
+        data = self.client.get(url_for('blog.index')).get_data(as_text=True)
+        self.assertIn('Popular Posts', data)
+        self.assertIn('<span class="badge badge-primary badge-pill"> 5</span>', data)
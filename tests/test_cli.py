@@ -5,8 +5,16 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from bluelog.models import Admin, Post, Category, Comment
-from bluelog.extensions import db
+import io
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from PIL import Image
+
+from bluelog.models import Admin, Post, Category, Comment, Link, PostRelated, ArchiveMonth
+from bluelog.extensions import db, page_cache, view_counter
 from tests.base import BaseTestCase
 
 
@@ -77,3 +85,223 @@ class CLITestCase(BaseTestCase):
 
         self.assertIn('Generating links...', result.output)
         self.assertIn('Done.', result.output)
+
+    def test_recount_command(self):
+        db.create_all()
+        category = Category(name='Default')
+        post = Post(title='Hello', category=category)
+        db.session.add_all([
+            category, post,
+            Comment(body='A comment', post=post, reviewed=True),
+            Comment(body='Not reviewed', post=post, reviewed=False)
+        ])
+        db.session.commit()
+        self.assertEqual(category.post_count, 0)
+        self.assertEqual(post.comment_count, 0)
+        updated_at = datetime(2018, 1, 1)
+        Post.query.update({Post.updated_at: updated_at})
+        db.session.commit()
+
+        result = self.runner.invoke(args=['recount'])
+        self.assertIn('Done.', result.output)
+        self.assertEqual(Category.query.get(1).post_count, 1)
+        self.assertEqual(Post.query.get(1).comment_count, 1)
+        self.assertEqual(ArchiveMonth.query.one().post_count, 1)
+        self.assertEqual(Post.query.get(1).updated_at, updated_at)
+
+    def test_backfill_command(self):
+        db.create_all()
+        post = Post(title='Hello', body='<p>Hello, <b>world</b>.</p><script>alert(1)</script>')
+        db.session.add(post)
+        db.session.commit()
+        db.session.execute('UPDATE post SET body_html = NULL, excerpt = NULL')
+
+        result = self.runner.invoke(args=['backfill'])
+        self.assertIn('Rendered 1 posts.', result.output)
+        post = Post.query.get(1)
+        self.assertEqual(post.excerpt, 'Hello, world.')
+        self.assertEqual(post.body_html, '<p>Hello, <b>world</b>.</p>')
+
+        result = self.runner.invoke(args=['backfill'])
+        self.assertIn('Rendered 0 posts.', result.output)
+
+    def test_freeze_command(self):
+        db.create_all()
+        category = Category(name='Default')
+        posts = [Post(title='Post %d' % i, body='Body %d' % i, category=category) for i in range(12)]
+        db.session.add_all([Admin(name='Grey Li', blog_title='Testlog'), category] + posts)
+        db.session.commit()
+        ArchiveMonth.update_post_counts()
+        db.session.commit()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        def read(filename):
+            with open(os.path.join(path, filename)) as f:
+                return f.read()
+
+        result = self.runner.invoke(args=['freeze', '--path', path])
+        self.assertIn('Done, 20 pages changed.', result.output)
+        self.assertEqual(view_counter.flush(), 0)
+        for filename in ('index.html', 'page-2.html', 'about/index.html', 'category/1/index.html',
+                         'category/1/page-2.html', 'post/1/index.html', 'post/12/index.html',
+                         'static/css/style.css'):
+            self.assertTrue(os.path.exists(os.path.join(path, filename)), filename)
+        index = read('index.html')
+        self.assertIn('href="post/12/index.html"', index)
+        self.assertIn('href="page-2.html"', index)
+        self.assertIn('href="static/css/style.css"', index)
+        self.assertIn('href="../../category/1/index.html"', read('post/1/index.html'))
+        # the comment form still posts to the application
+        self.assertIn('action="/post/1?"', read('post/1/index.html'))
+
+        result = self.runner.invoke(args=['freeze', '--path', path])
+        self.assertIn('Done, 0 pages changed.', result.output)
+
+        post = Post.query.get(1)
+        post.title = 'Changed'
+        db.session.commit()
+        page_cache.invalidate()
+        result = self.runner.invoke(args=['freeze', '--path', path, '--post', '1'])
+        self.assertIn('Done, 4 pages changed.', result.output)
+        self.assertIn('Changed', read('post/1/index.html'))
+        self.assertIn('Changed', read('page-2.html'))
+        self.assertIn('Changed', read('category/1/page-2.html'))
+
+    def test_related_command(self):
+        db.create_all()
+        category = Category(name='Default')
+        bodies = ['Python flask web framework tutorial', 'Flask web framework extensions',
+                  'Cooking pasta with tomato sauce', 'Tomato sauce recipe for pasta',
+                  'Gardening roses in spring', 'Spring roses gardening tips']
+        db.session.add_all([Post(title='Post %d' % i, body=body, category=category) for i, body in enumerate(bodies)])
+        db.session.commit()
+
+        result = self.runner.invoke(args=['related'])
+        self.assertIn('Updated the related posts of 6 posts.', result.output)
+        self.assertEqual([post.id for post in Post.query.get(1).related_posts()], [2])
+        self.assertEqual([post.id for post in Post.query.get(4).related_posts()], [3])
+        data = self.client.get('/post/1').get_data(as_text=True)
+        self.assertIn('Related Posts', data)
+        self.assertIn('href="/post/2">Post 1</a>', data)
+
+        result = self.runner.invoke(args=['related'])
+        self.assertIn('Updated the related posts of 0 posts.', result.output)
+
+        post = Post.query.get(5)
+        post.body = 'Python flask tips'
+        db.session.commit()
+        result = self.runner.invoke(args=['related'])
+        # the edited post, its old neighbour and its new ones
+        self.assertIn('Updated the related posts of 4 posts.', result.output)
+        self.assertIn(5, [post.id for post in Post.query.get(1).related_posts()])
+        self.assertIn(5, [post.id for post in Post.query.get(6).related_posts()])
+        self.assertEqual(PostRelated.query.filter_by(post_id=3).one().related_id, 4)
+
+        result = self.runner.invoke(args=['related', '--full'])
+        self.assertIn('Updated the related posts of 6 posts.', result.output)
+
+    def test_export_import_command(self):
+        db.create_all()
+        category = Category(name='Tech')
+        post = Post(title='Hello', body='<p>Hello, <b>world</b>.</p>\nSecond line', category=category)
+        comment = Comment(author='Guest', body='A comment', post=post, reviewed=True)
+        reply = Comment(author='Grey', body='A reply', post=post, reviewed=True, from_admin=True, replied=comment)
+        db.session.add_all([category, post, comment, reply, Link(name='GitHub', url='https://github.com')] +
+                           [Post(title='Post %d' % i, body='Body', category=category) for i in range(4)])
+        db.session.commit()
+        Post.query.update({Post.updated_at: datetime(2018, 1, 1)})
+        db.session.commit()
+        updated_at = dict(db.session.query(Post.id, Post.updated_at))
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        jsonl, markdown = os.path.join(path, 'blog.jsonl'), os.path.join(path, 'blog')
+
+        result = self.runner.invoke(args=['export', jsonl])
+        self.assertIn('Exported 9 records.', result.output)
+        result = self.runner.invoke(args=['export', markdown, '--format', 'markdown'])
+        self.assertIn('Exported 9 records.', result.output)
+        with open(os.path.join(markdown, 'posts', '00000001.md')) as f:
+            self.assertEqual(f.read().split('---\n')[2], '<p>Hello, <b>world</b>.</p>\nSecond line')
+
+        result = self.runner.invoke(args=['import', jsonl])
+        self.assertIn('The database has posts already', result.output)
+
+        for source in (jsonl, markdown):
+            db.drop_all()
+            db.create_all()
+            result = self.runner.invoke(args=['import', source, '--batch-size', '2'])
+            self.assertIn('Done, imported 9 records.', result.output)
+            self.assertFalse(os.path.exists(source + '.checkpoint'))
+            self.assertEqual(Category.query.get(1).post_count, 5)
+            post = Post.query.get(1)
+            self.assertEqual(post.comment_count, 2)
+            self.assertEqual(post.body_html, '<p>Hello, <b>world</b>.</p>\nSecond line')
+            self.assertEqual(Comment.query.get(2).replied_id, 1)
+            self.assertTrue(Comment.query.get(2).from_admin)
+            self.assertEqual(Link.query.one().name, 'GitHub')
+            self.assertEqual(dict(db.session.query(Post.id, Post.updated_at)), updated_at)
+
+    def test_import_command_resume(self):
+        from bluelog.transfer import export_records, import_records
+
+        db.create_all()
+        category = Category(name='Tech')
+        db.session.add_all([Post(title='Post %d' % i, body='Body', category=category) for i in range(10)])
+        db.session.commit()
+        records = list(export_records())
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        source, checkpoint = os.path.join(path, 'blog.jsonl'), os.path.join(path, 'blog.jsonl.checkpoint')
+        self.runner.invoke(args=['export', source])
+        db.drop_all()
+        db.create_all()
+
+        def interrupted():
+            for i, record in enumerate(records):
+                if i == 8:
+                    raise KeyboardInterrupt
+                yield record
+
+        with self.assertRaises(KeyboardInterrupt):
+            import_records(interrupted(), batch_size=3, checkpoint=checkpoint)
+        # the category and the first two batches of posts
+        self.assertEqual(Post.query.count(), 6)
+
+        result = self.runner.invoke(args=['import', source, '--batch-size', '3'])
+        self.assertIn('Done, imported 11 records.', result.output)
+        self.assertEqual([post.title for post in Post.query.order_by(Post.id)], ['Post %d' % i for i in range(10)])
+        self.assertEqual(Category.query.get(1).post_count, 10)
+
+    def test_images_command(self):
+        upload_path = self.runner.app.config['BLUELOG_UPLOAD_PATH']
+        self.addCleanup(shutil.rmtree, upload_path, True)
+        os.makedirs(upload_path, exist_ok=True)
+        Image.new('RGB', (1000, 500)).save(os.path.join(upload_path, 'old.jpg'))
+        os.makedirs(os.path.join(upload_path, 'ab', 'cd'))
+        Image.new('RGB', (1000, 500)).save(os.path.join(upload_path, 'ab', 'cd', 'abcd.png'))
+        with open(os.path.join(upload_path, 'notes.txt'), 'w') as f:
+            f.write('Not an image')
+
+        result = self.runner.invoke(args=['images'])
+        self.assertIn('Processed 2 images.', result.output)
+        self.assertTrue(os.path.exists(os.path.join(upload_path, 'variants', 'old.jpg', 'medium.webp')))
+        self.assertTrue(os.path.exists(os.path.join(upload_path, 'variants', 'ab', 'cd', 'abcd.png', 'medium.webp')))
+        result = self.runner.invoke(args=['images'])
+        self.assertIn('Processed 0 images.', result.output)
+        with open(os.path.join(upload_path, 'old.jpg'), 'rb') as f:
+            original = f.read()
+        result = self.runner.invoke(args=['images', '--all'])
+        self.assertIn('Processed 2 images.', result.output)
+        # the variants only, the original is not encoded again
+        with open(os.path.join(upload_path, 'old.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+        # a failure leaves no variants, the image is processed again by the next run
+        image = io.BytesIO()
+        Image.new('RGB', (1000, 500)).save(image, 'PNG')
+        with open(os.path.join(upload_path, 'broken.png'), 'wb') as f:
+            f.write(image.getvalue()[:200])
+        result = self.runner.invoke(args=['images'])
+        self.assertIn('Failed to process broken.png', result.output)
+        self.assertEqual(sorted(os.listdir(os.path.join(upload_path, 'variants'))), ['ab', 'old.jpg'])